@@ -0,0 +1,210 @@
+"""
+Load benchmark for the server_status cog.
+
+Starts a local stand-in for status.hoggitworld.com that serves the same JSON the
+cog expects, points a DCSServerStatus at it with a fake bot, and reports poll
+throughput, per-server staleness and event-loop lag.
+
+Run it from the root of a Red install that has the server_status cog installed,
+so `cogs.server_status` and `cogs.utils` are importable. The stand-in server only
+uses aiohttp APIs that exist on the aiohttp 1.0 pinned by discord.py 0.16, so it runs
+in the bot's own environment:
+
+    python /path/to/HoggyBot/benchmarks/server_status_bench.py --servers 300 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import arrow
+from aiohttp import web
+
+
+class StandInStatusServer:
+    """
+    Serves `/<key>` like status.hoggitworld.com, with configurable latency and error rate.
+    A fraction of the keys report a stale updateTime so they look offline to the cog.
+    """
+
+    def __init__(self, keys, latency, jitter, error_rate, offline_rate):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.offline = set(k for k in keys if random.random() < offline_rate)
+        self.requests = 0
+        self.errors = 0
+        self.started = time.time()
+
+    def status_for(self, key):
+        now = arrow.utcnow()
+        update_time = now.shift(seconds=-600) if key in self.offline else now
+        players = random.randint(1, 40)
+        return {
+            #Lets the benchmark tell when the cog last fetched this server successfully.
+            "benchServedAt": time.time(),
+            "serverName": "Stand-in {}".format(key),
+            "players": players,
+            "maxPlayers": 64,
+            "missionName": "Georgia At War v{}".format(random.randint(1, 3)),
+            "map": "Caucasus",
+            "updateTime": update_time.isoformat(),
+            "data": {
+                "updateTime": update_time.isoformat(),
+                "uptime": time.time() - self.started,
+                "metar": "UGKO 181200Z 27005KT 9999 FEW030 15/08 Q1015"
+            }
+        }
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text="stand-in error")
+        key = request.match_info["key"]
+        return web.Response(text=json.dumps(self.status_for(key)), content_type="application/json")
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_route("GET", "/{key}", self.handle)
+        self.handler = app.make_handler()
+        self.server = await asyncio.get_event_loop().create_server(self.handler, "127.0.0.1", port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        #aiohttp 1.x calls it finish_connections, later versions shutdown.
+        finish = getattr(self.handler, "shutdown", None) or self.handler.finish_connections
+        await finish(1.0)
+
+
+class FakeBot:
+    """
+    Just enough of a bot for DCSServerStatus to run without Discord.
+    """
+
+    def __init__(self):
+        self.presence_changes = 0
+
+    async def wait_until_ready(self):
+        return
+
+    async def change_presence(self, **kwargs):
+        self.presence_changes += 1
+
+    async def say(self, *args, **kwargs):
+        return
+
+    async def send_message(self, *args, **kwargs):
+        return
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def measure_loop_lag(samples, interval, stop):
+    loop = asyncio.get_event_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(loop.time() - expected, 0))
+
+
+async def measure_staleness(cog, samples, interval, stop):
+    """
+    Samples how old each server's last successful fetch is. Failed polls keep the old
+    status in the table, so errors and backoff show up as growing staleness.
+    """
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.time()
+        for alias in cog.key_data:
+            status = cog.status_table.get(alias, {}).get("status")
+            if status is not None:
+                samples.setdefault(alias, []).append(now - status["benchServedAt"])
+
+
+async def run(args, DCSServerStatus):
+    keys = ["bench{}".format(i) for i in range(args.servers)]
+    stand_in = StandInStatusServer(keys, args.latency_ms / 1000, args.jitter_ms / 1000,
+                                   args.error_rate, args.offline_rate)
+    port = await stand_in.start(args.port)
+
+    from cogs.utils.dataIO import dataIO
+    dataIO.save_json("data/server_status/server.json",
+                     {key: {"alias": key, "key": key} for key in keys})
+    dataIO.save_json("data/server_status/settings.json", {
+        "poll_concurrency": args.concurrency,
+        "poll_timeout_seconds": args.timeout
+    })
+
+    bot = FakeBot()
+    cog = DCSServerStatus(bot)
+    cog.base_url = "http://127.0.0.1:{}/".format(port)
+
+    stop = asyncio.Event()
+    lag_samples = []
+    staleness_samples = {}
+    monitors = [
+        asyncio.ensure_future(measure_loop_lag(lag_samples, 0.05, stop)),
+        asyncio.ensure_future(measure_staleness(cog, staleness_samples, 1, stop))
+    ]
+    started = time.time()
+    await asyncio.sleep(args.duration)
+    elapsed = time.time() - started
+    stop.set()
+    getattr(cog, "_DCSServerStatus__unload")()
+    await asyncio.gather(*monitors)
+    await stand_in.stop()
+
+    worst = [max(ages) for ages in staleness_samples.values()]
+    medians = [percentile(ages, 0.5) for ages in staleness_samples.values()]
+    never_polled = len([key for key in keys if key not in staleness_samples])
+    print("Servers:               {} ({} offline on the stand-in)".format(args.servers, len(stand_in.offline)))
+    print("Duration:              {:.1f}s".format(elapsed))
+    print("Polls served:          {} ({} errors)".format(stand_in.requests, stand_in.errors))
+    print("Poll throughput:       {:.1f} req/s".format(stand_in.requests / elapsed))
+    print("Presence changes sent: {}".format(bot.presence_changes))
+    print("Staleness per server:  median {:.1f}s, p95 {:.1f}s, worst {:.1f}s ({} never polled)".format(
+        percentile(medians, 0.5), percentile(worst, 0.95), max(worst) if worst else 0.0, never_polled))
+    print("Event loop lag:        p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms".format(
+        percentile(lag_samples, 0.5) * 1000, percentile(lag_samples, 0.99) * 1000,
+        max(lag_samples) * 1000 if lag_samples else 0.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=200, help="number of tracked server keys")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run for")
+    parser.add_argument("--latency-ms", type=float, default=80, help="mean stand-in response latency")
+    parser.add_argument("--jitter-ms", type=float, default=40, help="+/- latency jitter")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="fraction of requests answered with a 500")
+    parser.add_argument("--offline-rate", type=float, default=0.1, help="fraction of servers reporting a stale updateTime")
+    parser.add_argument("--concurrency", type=int, default=10, help="poll_concurrency setting for the cog")
+    parser.add_argument("--timeout", type=float, default=10, help="poll_timeout_seconds setting for the cog")
+    parser.add_argument("--port", type=int, default=0, help="stand-in port, 0 picks a free one")
+    parser.add_argument("--red-path", default=os.getcwd(), help="root of the Red install holding cogs/")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.red_path))
+    from cogs.server_status import DCSServerStatus
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs("data/server_status")
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run(args, DCSServerStatus))
+
+
+if __name__ == "__main__":
+    main()
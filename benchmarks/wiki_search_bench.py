@@ -0,0 +1,111 @@
+"""
+Compares the wiki cog's two search paths on recorded responses: the JSON search
+API (`parse_api_search`) and the Special:Search HTML scrape (`parse_results`).
+
+Record fixtures once from the live wiki, then benchmark them offline. Run from the
+root of a Red install that has the wiki cog installed, so `cogs.wiki` is importable:
+
+    python /path/to/HoggyBot/benchmarks/wiki_search_bench.py --record "f18" "harrier" "srs"
+    python /path/to/HoggyBot/benchmarks/wiki_search_bench.py
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from urllib.request import urlopen
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "wiki")
+
+
+class RecordedResponse:
+    def __init__(self, body):
+        self.body = body
+
+    async def text(self):
+        return self.body
+
+
+def make_wiki():
+    from cogs.wiki import HoggitWiki
+    #Skip __init__: it starts background tasks and reads the cog's data files.
+    wiki = HoggitWiki.__new__(HoggitWiki)
+    wiki.base_url = "https://wiki.hoggitworld.com"
+    wiki.api_url = wiki.base_url + "/api.php"
+    return wiki
+
+
+def fixture_name(query):
+    return "".join(c if c.isalnum() else "_" for c in query.lower())
+
+
+def record(wiki, queries, fixtures):
+    os.makedirs(fixtures, exist_ok=True)
+    for query in queries:
+        name = fixture_name(query)
+        with urlopen(wiki.api_search_url(query)) as resp:
+            api_body = resp.read()
+        with urlopen(wiki.url(query)) as resp:
+            html_body = resp.read()
+        with open(os.path.join(fixtures, name + ".json"), "wb") as f:
+            f.write(api_body)
+        with open(os.path.join(fixtures, name + ".html"), "wb") as f:
+            f.write(html_body)
+        print("Recorded {}: {} bytes JSON, {} bytes HTML".format(query, len(api_body), len(html_body)))
+
+
+def time_call(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations
+
+
+def bench(wiki, fixtures, iterations):
+    names = sorted(os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(fixtures, "*.json")))
+    names = [n for n in names if os.path.exists(os.path.join(fixtures, n + ".html"))]
+    if not names:
+        print("No fixtures in {}. Record some first with --record <query>...".format(fixtures))
+        return
+    loop = asyncio.get_event_loop()
+    totals = {"json_bytes": 0, "html_bytes": 0, "json_time": 0.0, "html_time": 0.0}
+    print("{:<24} {:>10} {:>10} {:>12} {:>12}".format("fixture", "json B", "html B", "json parse", "html parse"))
+    for name in names:
+        with open(os.path.join(fixtures, name + ".json"), encoding="utf-8") as f:
+            api_body = f.read()
+        with open(os.path.join(fixtures, name + ".html"), encoding="utf-8") as f:
+            html_body = f.read()
+        json_time = time_call(lambda: wiki.parse_api_search(json.loads(api_body)), iterations)
+        html_time = time_call(
+            lambda: loop.run_until_complete(wiki.parse_results(RecordedResponse(html_body))), iterations)
+        totals["json_bytes"] += len(api_body.encode("utf-8"))
+        totals["html_bytes"] += len(html_body.encode("utf-8"))
+        totals["json_time"] += json_time
+        totals["html_time"] += html_time
+        print("{:<24} {:>10} {:>10} {:>10.3f}ms {:>10.3f}ms".format(
+            name, len(api_body), len(html_body), json_time * 1000, html_time * 1000))
+    print("Payload: {:.1f}x smaller, parse: {:.1f}x faster with the JSON API".format(
+        totals["html_bytes"] / max(totals["json_bytes"], 1),
+        totals["html_time"] / max(totals["json_time"], 1e-9)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", nargs="+", metavar="QUERY", help="fetch and save fixtures for these queries")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="fixture directory")
+    parser.add_argument("--iterations", type=int, default=200, help="parses per fixture and path")
+    parser.add_argument("--red-path", default=os.getcwd(), help="root of the Red install holding cogs/")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.red_path))
+    wiki = make_wiki()
+    if args.record:
+        record(wiki, args.record, args.fixtures)
+    else:
+        bench(wiki, args.fixtures, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
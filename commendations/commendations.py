@@ -3,12 +3,265 @@ from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
 from .utils.chat_formatting import pagify, box
+import asyncio
+import collections
+import heapq
+import json
+import math
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 class SameUserError(Exception):
     pass
 
+#Leaderboard windows, in days. None means all time.
+LEADERBOARD_WINDOWS = {"week": 7, "month": 30, "all": None}
+
+class Leaderboard:
+    """
+    Commendation counts for one server, all time and bucketed per UTC day, updated
+    as each commendation comes in. Also remembers the last name seen for each user,
+    for members who have since left the server.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.days = {}
+        self.names = {}
+
+    def add(self, record):
+        user_id = record["user.id"]
+        self.counts[user_id] += 1
+        self.names[user_id] = record["user"]
+        #Commendations from before timestamps were recorded only count towards all time.
+        if "time" in record:
+            day = int(record["time"] // 86400)
+            self.days.setdefault(day, collections.Counter())[user_id] += 1
+
+    def top(self, amount, days=None):
+        """
+        The `amount` most commended users as (user id, count), over the last `days` days or all time.
+        """
+        if days is None:
+            counts = self.counts
+        else:
+            today = int(time.time() // 86400)
+            counts = collections.Counter()
+            for day in range(today - days + 1, today + 1):
+                counts.update(self.days.get(day, {}))
+        return heapq.nlargest(amount, counts.items(), key=lambda item: item[1])
+
+class SearchIndex:
+    """
+    Inverted index over the text of one server's commendations. Each token maps to
+    the records containing it and how often it appears there, so a query only
+    touches the records sharing a term with it.
+    """
+
+    #Relevance halves for every `half_life` days of age, down to half its full weight.
+    half_life = 90
+
+    def __init__(self):
+        self.postings = {}
+        self.size = 0
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"[a-z0-9']+", text.lower())
+
+    def add(self, record):
+        self.size += 1
+        for token, count in collections.Counter(self.tokenize(record.get("text", ""))).items():
+            self.postings.setdefault(token, []).append((record, count))
+
+    def recency(self, record, now):
+        if "time" not in record:
+            return 0.5
+        age_days = max(now - record["time"], 0) / 86400
+        return 0.5 + 0.5 * 0.5 ** (age_days / self.half_life)
+
+    def search(self, query, limit=50):
+        """
+        Returns (number of matches, best `limit` records) for records matching any term
+        of `query`. Ranked by tf-idf relevance, weighted towards recent commendations.
+        """
+        scores = {}
+        records = {}
+        for token in set(self.tokenize(query)):
+            postings = self.postings.get(token, [])
+            if not postings:
+                continue
+            idf = math.log(1 + self.size / len(postings))
+            for record, count in postings:
+                seq = record["seq"]
+                scores[seq] = scores.get(seq, 0) + (1 + math.log(count)) * idf
+                records[seq] = record
+        now = time.time()
+        best = heapq.nlargest(limit, scores, key=lambda seq: scores[seq] * self.recency(records[seq], now))
+        return len(scores), [records[seq] for seq in best]
+
+class CommendationStore:
+    """
+    Commendations are kept in a snapshot (commendations.json) plus an append-only
+    log (commendations.log.jsonl). Each commend appends a single line to the log, so
+    writing one costs the same however long the history gets. The log is folded
+    back into the snapshot every `compact_every` records and when the cog unloads.
+
+    Every record gets a sequence number. The snapshot remembers the last one it
+    holds, so log lines that were already compacted are skipped on replay, and
+    compaction keeps any log lines newer than the snapshot it wrote.
+
+    All file writes happen in order on one worker thread, off the event loop.
+    """
+
+    def __init__(self, snapshot_path, log_path, compact_every=500):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.compact_every = compact_every
+        self.records = []
+        self.by_server = {}
+        self.leaderboards = {}
+        self.search_indexes = {}
+        self.seq = 0
+        self.indexed_seq = 0
+        self.uncompacted = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        #Appends are written and indexed one at a time, so every record up to
+        #indexed_seq is in self.records when a snapshot is taken.
+        self.append_lock = asyncio.Lock()
+        self.load()
+
+    def load(self):
+        snapshot = dataIO.load_json(self.snapshot_path)
+        if "version" not in snapshot:
+            snapshot = self.migrate(snapshot)
+        for record in snapshot["commendations"]:
+            self.index(record)
+        self.seq = snapshot["seq"]
+        for record in self.read_log():
+            if record["seq"] > self.seq:
+                self.index(record)
+                self.seq = record["seq"]
+                self.uncompacted += 1
+
+    def migrate(self, legacy):
+        """
+        Flattens the old {server id: {user id: [commendation]}} file into a version 2
+        snapshot. The old file is kept next to it as commendations.v1.json.
+        """
+        records = []
+        for server_id, users in legacy.items():
+            for user_commendations in users.values():
+                for commendation in user_commendations:
+                    record = dict(commendation)
+                    record["server.id"] = server_id
+                    record["seq"] = len(records) + 1
+                    records.append(record)
+        snapshot = {"version": 2, "seq": len(records), "commendations": records}
+        if legacy:
+            dataIO.save_json(os.path.splitext(self.snapshot_path)[0] + ".v1.json", legacy)
+        dataIO.save_json(self.snapshot_path, snapshot)
+        print("Migrated {} commendations to the append-only store".format(len(records)))
+        return snapshot
+
+    def read_log(self):
+        if not os.path.exists(self.log_path):
+            return []
+        records = []
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    #A line cut short by a crash or a failed write. It was never acknowledged.
+                    continue
+        return records
+
+    def index(self, record):
+        self.records.append(record)
+        self.indexed_seq = max(self.indexed_seq, record["seq"])
+        users = self.by_server.setdefault(record["server.id"], {})
+        users.setdefault(record["user.id"], []).append(record)
+        self.leaderboard(record["server.id"]).add(record)
+        self.search_index(record["server.id"]).add(record)
+
+    def leaderboard(self, server_id):
+        if server_id not in self.leaderboards:
+            self.leaderboards[server_id] = Leaderboard()
+        return self.leaderboards[server_id]
+
+    def search_index(self, server_id):
+        if server_id not in self.search_indexes:
+            self.search_indexes[server_id] = SearchIndex()
+        return self.search_indexes[server_id]
+
+    def for_server(self, server_id):
+        return self.by_server.get(server_id, {})
+
+    def for_user(self, server_id, user_id):
+        return self.for_server(server_id).get(user_id, [])
+
+    async def append(self, record):
+        """
+        Writes `record`'s log line, then indexes it. Returns once the line is on disk;
+        if the write fails the error is raised and the record is not kept.
+        """
+        async with self.append_lock:
+            #Never reused, even if this write fails, so a torn line can't clash with a later one.
+            self.seq += 1
+            record["seq"] = self.seq
+            line = json.dumps(record) + "\n"
+            await asyncio.get_event_loop().run_in_executor(self.executor, self.write_line, line)
+            self.index(record)
+            self.uncompacted += 1
+            if self.uncompacted >= self.compact_every:
+                self.compact()
+
+    def write_line(self, line):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            start = f.tell()
+            try:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError:
+                #Don't leave a partial line for the next append to run on from.
+                f.truncate(start)
+                raise
+
+    def compact(self):
+        snapshot = {"version": 2, "seq": self.indexed_seq, "commendations": list(self.records)}
+        self.uncompacted = 0
+        future = self.executor.submit(self.write_snapshot, snapshot)
+        future.add_done_callback(self.compacted)
+        return future
+
+    @staticmethod
+    def compacted(future):
+        #The log is only rewritten after the snapshot is written, so a failure here loses nothing.
+        if future.exception() is not None:
+            print("Commendations: Failed to compact the log: {}".format(future.exception()))
+
+    def write_snapshot(self, snapshot):
+        dataIO.save_json(self.snapshot_path, snapshot)
+        #Only now is it safe to shorten the log; until the snapshot lands, replay needs it.
+        #Lines past the snapshot's seq are kept. Appends share this thread, so none land mid-rewrite.
+        newer = [r for r in self.read_log() if r["seq"] > snapshot["seq"]]
+        tmp = self.log_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in newer:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.log_path)
+
+    def close(self):
+        if self.uncompacted:
+            self.compact()
+        self.executor.shutdown(wait=True)
+
 class Commendations:
     """Commendations
 
@@ -18,21 +271,15 @@ class Commendations:
     def __init__(self, bot):
         self.bot = bot
         self.file_path = "data/commendations/commendations.json"
-        self.c_commendations = dataIO.load_json(self.file_path)
+        self.log_path = "data/commendations/commendations.log.jsonl"
+        self.db = CommendationStore(self.file_path, self.log_path)
 
-    def store(self, ctx, commendation):
-        server = ctx.message.server
-        user = commendation['user.id']
-        if server.id not in self.c_commendations:
-            self.c_commendations[server.id] = {}
-        server_commendations = self.c_commendations[server.id]
-        if user not in server_commendations:
-            server_commendations[user] = []
-        user_commendations = server_commendations[user]
-        user_commendations.append(commendation)
-        server_commendations[user] = user_commendations
-        self.c_commendations[server.id] = server_commendations
-        dataIO.save_json(self.file_path, self.c_commendations)
+    def __unload(self):
+        self.db.close()
+
+    async def store(self, ctx, commendation):
+        commendation['server.id'] = ctx.message.server.id
+        await self.db.append(commendation)
 
     def commendation(self, author, user, text):
         if author.id == user.id:
@@ -43,6 +290,7 @@ class Commendations:
         comm['text'] = text
         comm['author.id'] = author.id
         comm['author'] = author.name
+        comm['time'] = int(time.time())
         return comm
 
     @commands.group(name="commend", pass_context=True)
@@ -53,10 +301,13 @@ class Commendations:
         author = ctx.message.author
         try:
             commendation = self.commendation(author, user, text)
-            self.store(ctx, commendation)
+            await self.store(ctx, commendation)
             await self.bot.say("Commended {}.".format(user.name))
         except SameUserError:
             await self.bot.say("You can't give yourself a commendation you nitwit")
+        except OSError as e:
+            print("Commendations: Failed to write a commendation: {}".format(e))
+            await self.bot.say("Couldn't save that commendation, try again later")
 
     @commands.group(name = "commendations", pass_context=True)
     async def commendations(self, ctx):
@@ -64,49 +315,78 @@ class Commendations:
             await self.bot.send_cmd_help(ctx)
 
     @commendations.command(name = "list", pass_context=True)
-    async def list(self, ctx, user: discord.Member):
+    async def list(self, ctx, user: discord.Member, flag = ""):
         """
         Provides the number of commendations the given user has received
+        Add --verbose to see each commendation and who gave it
         """
-        server_id = ctx.message.server.id
-        if server_id not in self.c_commendations:
+        user_comms = self.db.for_user(ctx.message.server.id, user.id)
+        if not user_comms:
             await self.bot.say("No commendations found for {}".format(user.name))
             return
-        server_comms = self.c_commendations[server_id]
-        if user.id not in server_comms:
-            await self.bot.say("No commendations found for {}".format(user.name))
-            return
-        user_comms = server_comms[user.id]
         await self.bot.say("{} has {} commendations".format(user.name, len(user_comms)))
+        if flag == "--verbose":
+            lines = [self.format_commendation(c) for c in reversed(user_comms)]
+            for page in pagify("\n".join(lines)):
+                await self.bot.say(box(page))
+
+    @commendations.command(name = "search", pass_context=True)
+    async def search(self, ctx, *, terms):
+        """
+        Searches the reasons given for commendations on this server
+        """
+        total, results = self.db.search_index(ctx.message.server.id).search(terms)
+        if not results:
+            await self.bot.say("No commendations mention that")
+            return
+        lines = ["{}: {}".format(c["user"], self.format_commendation(c)) for c in results]
+        header = "{} commendations found".format(total)
+        if total > len(results):
+            header += ", showing the best {}".format(len(results))
+        await self.bot.say(header)
+        for page in pagify("\n".join(lines)):
+            await self.bot.say(box(page))
+
+    @staticmethod
+    def format_commendation(commendation):
+        when = time.strftime("%Y-%m-%d", time.gmtime(commendation["time"])) if "time" in commendation else "undated"
+        return "[{}] from {}: {}".format(when, commendation["author"], commendation["text"] or "(no reason given)")
 
     @commendations.command(name = "leaderboard", pass_context = True)
-    async def leaderboard(self, ctx):
+    async def leaderboard(self, ctx, window = "all"):
         """
         Returns a leaderboard of the top 10 commendees on your server.
+        Pass week or month to only count recent commendations.
         """
-        server_id = ctx.message.server.id
-        if server_id not in self.c_commendations:
+        window = window.lower()
+        if window not in LEADERBOARD_WINDOWS:
+            await self.bot.say("Pick one of: {}".format(", ".join(LEADERBOARD_WINDOWS)))
+            return
+        server = ctx.message.server
+        commended_users = self.topCommendees(server.id, 10, LEADERBOARD_WINDOWS[window])
+        if not commended_users:
             await self.bot.say("No commendations on this server yet")
             return
-        commended_users = self.topCommendees(self.c_commendations[server_id], 10)
-        commended_user_ranks = []
         leaders=[]
         rank=1
         for user_id, count in commended_users:
-            user = ctx.message.server.get_member(user_id).name
-            leaders.append("#{} {}: {}".format(rank, user, count))
+            leaders.append("#{} {}: {}".format(rank, self.member_name(server, user_id), count))
             rank += 1
+        title = "Top 10 Commendees" if window == "all" else "Top 10 Commendees this {}".format(window)
         message = """
-        Top 10 Commendees
+        {}
         ```{}```
-        """.format("\n".join(leaders))
+        """.format(title, "\n".join(leaders))
         await self.bot.say(message)
 
-    def topCommendees(self, commendation_dict, amount):
-        dic_to_list = lambda dic: [(k, len(v)) for (k, v) in dic.items()]
-        commendation_counts = dic_to_list(commendation_dict)
-        commendation_counts = sorted(commendation_counts, key=lambda x: x[1], reverse=True)
-        return commendation_counts[:amount]
+    def member_name(self, server, user_id):
+        member = server.get_member(user_id)
+        if member:
+            return member.name
+        return "{} (left)".format(self.db.leaderboard(server.id).names.get(user_id, user_id))
+
+    def topCommendees(self, server_id, amount, days=None):
+        return self.db.leaderboard(server_id).top(amount, days)
 
 def check_folders():
     if not os.path.exists("data/commendations"):
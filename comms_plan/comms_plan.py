@@ -1,7 +1,7 @@
 import csv
-import aiohttp
 import io
 from discord.ext import commands
+from .http_client import acquire_client, release_client
 
 
 class CommsPlan:
@@ -11,13 +11,16 @@ class CommsPlan:
 
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self.http = acquire_client("comms_plan")
         #Make configurable.
         self.comms_plan_url ="https://docs.google.com/spreadsheets/d/1a63VD2WXmShIwpiTTfHuK-5yWKw-3AtXLbv1LBjMyCE" 
         self.comms_plan_export = self.comms_plan_url + "/export?exportFormat=csv"
 
+    def __unload(self):
+        release_client("comms_plan")
+
     async def fetch_comms_plan(self):
-        resp = await self.session.get(self.comms_plan_export)
+        resp = await self.http.get(self.comms_plan_export)
         if (resp.status != 200):
             await self.bot.say("Error getting comms plan. Check logs")
             raise Exception("Could not get status")
@@ -1,42 +1,180 @@
 import asyncio
+import collections
 import os
 import discord
 import time
-import sys
 from .utils import checks
 from .utils.dataIO import fileIO
 from discord.ext import commands
 
+class SessionTimers:
+    """
+    The warning and expiry timers for each active GCI, keyed by user id.
+
+    Timers are event loop handles from `loop.call_at`, so they sit on the loop's own
+    timer heap: they fire on time, and rescheduling or cancelling one is cheap.
+    """
+
+    def __init__(self):
+        self.handles = {}
+
+    def schedule(self, user_id, *timers):
+        """
+        Replaces `user_id`'s timers with `timers`, given as (unix time, callback) pairs.
+        """
+        self.cancel(user_id)
+        loop = asyncio.get_event_loop()
+        offset = loop.time() - time.time()
+        self.handles[user_id] = [loop.call_at(when + offset, callback) for when, callback in timers]
+
+    def cancel(self, user_id):
+        for handle in self.handles.pop(user_id, []):
+            handle.cancel()
+
+    def cancel_all(self):
+        for user_id in list(self.handles):
+            self.cancel(user_id)
+
+class RoleQueue:
+    """
+    Applies role adds and removes in the background, one at a time and at most one
+    every `min_interval` seconds. Requests for the same member are coalesced: the
+    latest one replaces any that hasn't gone out yet, so the member ends up in the
+    last requested state whatever roles they had before. Rate limited requests are
+    retried with backoff.
+    """
+
+    def __init__(self, bot, min_interval=0.5, max_attempts=5):
+        self.bot = bot
+        self.min_interval = min_interval
+        self.max_attempts = max_attempts
+        self.pending = collections.OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    def add(self, member, role):
+        self.queue(member, role, True)
+
+    def remove(self, member, role):
+        self.queue(member, role, False)
+
+    def queue(self, member, role, grant):
+        self.pending.pop(member.id, None)
+        self.pending[member.id] = (member, role, grant)
+        self.wakeup.set()
+
+    def stop(self):
+        self.task.cancel()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                member, role, grant = self.pending.popitem(last=False)[1]
+                await self.apply(member, role, grant)
+                await asyncio.sleep(self.min_interval)
+
+    async def apply(self, member, role, grant):
+        for attempt in range(self.max_attempts):
+            try:
+                if grant:
+                    await self.bot.add_roles(member, role)
+                else:
+                    await self.bot.remove_roles(member, role)
+                return
+            except discord.HTTPException as e:
+                if getattr(e.response, "status", None) != 429:
+                    log("Couldn't {} {} role on {}: {}".format("set" if grant else "unset", role.name, member.name, e))
+                    return
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                log("Couldn't {} {} role on {}: {}".format("set" if grant else "unset", role.name, member.name, e))
+                return
+        log("Gave up on the {} role for {} after {} rate limited attempts".format(role.name, member.name, self.max_attempts))
+
 class GCI:
     """
     Tracks active GCIs on hoggit
     """
 
-    def __init__(self, bot, dataFile):
+    def __init__(self, bot, dataFile, sessionsFile):
         self.bot = bot
         self.dataFile = dataFile
+        self.sessionsFile = sessionsFile
         self.data = fileIO(dataFile, "load")
-        self.active_gcis = []
+        self.active_gcis = {}
         self.active_role = None
-        self.killSwitch = False
+        self.role_cache = {}
+        self.role_queue = RoleQueue(bot)
         self.active_time = 60 * 30 #30 minutes.
         self.warn_time = 60 * 25#25 minutes
-        self.reminded = []
-        asyncio.ensure_future(self.update_roles())
-        asyncio.ensure_future(self.start_monitor())
+        self.timers = SessionTimers()
+        asyncio.ensure_future(self.startup())
 
 
     def __unload(self):
-        log("Setting killswitch to True!")
-        self.killSwitch = True
+        log("Cancelling GCI timers")
+        self.timers.cancel_all()
+        self.role_queue.stop()
+
 
+    async def startup(self):
+        await self.update_roles()
+        await self.restore_sessions()
+
+    async def restore_sessions(self):
+        """
+        Picks up the sessions journaled before a reload or restart. One pass over the
+        members holding the active role: those with a live session get it back with
+        its timers, the rest have the role removed.
+        """
+        journal = fileIO(self.sessionsFile, "load")
+        if self.active_role is None:
+            if journal:
+                log("Active role is not set. Dropping {} journaled sessions".format(len(journal)))
+                self.save_sessions()
+            return
+        now = time.time()
+        stranded = []
+        for member in self.active_role.server.members:
+            if self.active_role not in member.roles:
+                continue
+            entry = journal.get(member.id)
+            if entry is None or entry['start_time'] + self.active_time <= now:
+                stranded.append(member)
+                continue
+            gci = {}
+            gci['user'] = member
+            gci['start_time'] = entry['start_time']
+            gci['freq'] = entry['freq']
+            gci['remarks'] = entry['remarks']
+            self.active_gcis[member.id] = gci
+            self.schedule_timers(gci)
+        log("Restored {} GCIs. Removing the active role from {} stranded members".format(
+            len(self.active_gcis), len(stranded)))
+        self.save_sessions()
+        for member in stranded:
+            self.clear_active_role(member)
+
+    def save_sessions(self):
+        sessions = {}
+        for user_id, gci in self.active_gcis.items():
+            sessions[user_id] = {
+                'user_id': user_id,
+                'server_id': gci['user'].server.id,
+                'freq': gci['freq'],
+                'remarks': gci['remarks'],
+                'start_time': gci['start_time']
+            }
+        fileIO(self.sessionsFile, 'save', sessions)
 
     async def update_roles(self):
         await self.bot.wait_until_ready()
         for server in self.bot.servers:
             if 'active_role_id' in self.data:
                 active_role_id = self.data['active_role_id']
-                role = next(r for r in server.roles if r.id == active_role_id)
+                role = self.server_roles(server).get(active_role_id)
                 if role:
                     log("Active role was set.")
                     self.active_role = role
@@ -51,48 +189,73 @@ class GCI:
                 return
 
 
-    async def start_monitor(self):
-        if self.killSwitch:
-            log("Killswitch hit. Not re-polling")
+    def server_roles(self, server):
+        """
+        The server's roles by id. Kept up to date by the role events below.
+        """
+        if server.id not in self.role_cache:
+            self.role_cache[server.id] = {r.id: r for r in server.roles}
+        return self.role_cache[server.id]
+
+    async def on_server_role_create(self, role):
+        self.server_roles(role.server)[role.id] = role
+
+    async def on_server_role_update(self, before, after):
+        self.server_roles(after.server)[after.id] = after
+        if self.active_role is not None and self.active_role.id == after.id:
+            self.active_role = after
+
+    async def on_server_role_delete(self, role):
+        self.server_roles(role.server).pop(role.id, None)
+        if self.active_role is not None and self.active_role.id == role.id:
+            log("Active role {} was deleted. Not setting it any more".format(role.name))
+            self.active_role = None
+
+    def schedule_timers(self, gci):
+        user_id = gci['user'].id
+        self.timers.schedule(user_id,
+            (gci['start_time'] + self.warn_time, lambda: asyncio.ensure_future(self.warn(user_id))),
+            (gci['start_time'] + self.active_time, lambda: asyncio.ensure_future(self.expire(user_id))))
+
+    async def warn(self, user_id):
+        gci = self.active_gcis.get(user_id)
+        if gci is None:
+            return
+        try:
+            await self.bot.send_message(gci['user'], "You have been active as GCI for 25 minutes, in 5 minutes you will be automatically signed-off. To continue for another 30 minutes, use !gci refresh")
+        except Exception as e:
+            log("Couldn't warn {}: {}".format(gci['user'].name, e))
+
+    async def expire(self, user_id):
+        gci = self.active_gcis.get(user_id)
+        if gci is None:
             return
-        await self.bot.wait_until_ready()
         try:
-            for gci in self.active_gcis:
-                if gci['start_time'] + self.active_time < time.time():
-                    await self.bot.send_message(gci['user'], "30 minute duration achieved. Signing off.")
-                    await self.midnight(gci['user'])
-                elif gci['start_time'] + self.warn_time < time.time():
-                    if gci['user'].id not in self.reminded:
-                        await self.bot.send_message(gci['user'], "You have been active as GCI for 25 minutes, in 5 minutes you will be automatically signed-off. To continue for another 30 minutes, use !gci refresh")
-                        self.reminded.append(gci['user'].id)
-        except:
-            log("Unexpected error with the gci monitor: " + sys.exc_info()[0])
-        finally:
-            await asyncio.sleep(60)
-            asyncio.ensure_future(self.start_monitor())
-
-
-    async def clear_active_role(self,user):
+            await self.bot.send_message(gci['user'], "30 minute duration achieved. Signing off.")
+        except Exception as e:
+            log("Couldn't tell {} they were signed off: {}".format(gci['user'].name, e))
+        await self.midnight(gci['user'])
+
+
+    def clear_active_role(self,user):
         if self.active_role:
             log("Active role is available. Unset {} role on {}".format(user.name, self.active_role))
-            await self.bot.remove_roles(user, self.active_role)
+            self.role_queue.remove(user, self.active_role)
         else:
             log("Active role is not set. Skipping")
 
-    async def add_active_role(self,user):
+    def add_active_role(self,user):
         if self.active_role:
             log("Active role is available. Setting {} role on {}".format(user.name, self.active_role))
-            await self.bot.add_roles(user, self.active_role)
+            self.role_queue.add(user, self.active_role)
         else:
             log("Active role is not set. Skipping")
 
-    def remove_reminded_status(self, user):
-        self.reminded[:] = [user_id for user_id in self.reminded if user_id != user.id]
-
     async def midnight(self, user):
-        await self.clear_active_role(user)
-        self.remove_reminded_status(user)
-        self.active_gcis[:] = [gci for gci in self.active_gcis if gci['user'].id != user.id]
+        self.timers.cancel(user.id)
+        self.active_gcis.pop(user.id, None)
+        self.save_sessions()
+        self.clear_active_role(user)
 
     async def sunrise(self, user, freq, remarks):
         log("Adding {} as GCI".format(user.name))
@@ -101,9 +264,11 @@ class GCI:
         gci['start_time'] = time.time()
         gci['freq'] = freq
         gci['remarks'] = remarks
-        self.active_gcis.append(gci)
-        await self.add_active_role(user)
-        log("Added Active Role to {}".format(user.name))
+        self.active_gcis[user.id] = gci
+        self.schedule_timers(gci)
+        self.save_sessions()
+        self.add_active_role(user)
+        log("Queued Active Role for {}".format(user.name))
 
     def valid_user(self, user: discord.User):
         return True
@@ -118,7 +283,7 @@ class GCI:
             await self.bot.say("No GCIs currently online.")
             return
         response = "Current GCIs online:\n"
-        for gci in self.active_gcis:
+        for gci in self.active_gcis.values():
             response += "{} ({}) - {}\n".format(
                             gci['user'].name,
                             gci['freq'],
@@ -140,12 +305,13 @@ class GCI:
     async def _refresh(self, ctx):
         """Refreshes your timer back to 30 minutes"""
         author = ctx.message.author
-        for gci in self.active_gcis:
-            if gci['user'].id == author.id:
-                self.remove_reminded_status(author)
-                gci['start_time'] = time.time()
-                await self.bot.send_message(author, "Refreshed your GCI timer for another 30 minutes")
-                return
+        gci = self.active_gcis.get(author.id)
+        if gci:
+            gci['start_time'] = time.time()
+            self.schedule_timers(gci)
+            self.save_sessions()
+            await self.bot.send_message(author, "Refreshed your GCI timer for another 30 minutes")
+            return
         await self.bot.send_message(author, "Doesn't look like you were signed up as GCI yet. Use !gci sunrise <freq>")
 
 
@@ -153,11 +319,10 @@ class GCI:
     async def _midnight(self, ctx):
         """Removes you from the list of active GCIs."""
         author = ctx.message.author
-        for gci in self.active_gcis:
-            if gci['user'].id == author.id:
-                await self.midnight(author)
-                await self.bot.say("{}, Signing off.".format(author.name))
-                return
+        if author.id in self.active_gcis:
+            await self.midnight(author)
+            await self.bot.say("{}, Signing off.".format(author.name))
+            return
         await self.bot.say("You weren't signed up as a GCI.")
 
 
@@ -186,7 +351,12 @@ def setup(bot):
         print("Creating empty data.json")
         fileIO(f, "save", {})
 
-    bot.add_cog(GCI(bot, f))
+    sessions = "data/gci/sessions.json"
+    if not fileIO(sessions, "check"):
+        print("Creating empty sessions.json")
+        fileIO(sessions, "save", {})
+
+    bot.add_cog(GCI(bot, f, sessions))
 
 def log(s):
     print("[GCI]: {}".format(s))
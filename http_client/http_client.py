@@ -0,0 +1,237 @@
+import asyncio
+import aiohttp
+import collections
+import inspect
+import random
+import time
+from urllib.parse import urlparse
+from discord.ext import commands
+from .utils import checks
+from .utils.chat_formatting import pagify, box
+
+#Statuses worth another attempt: rate limiting and transient upstream failures.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class ClientClosed(aiohttp.ClientError):
+    """
+    Raised for requests made through a client after it was closed, usually by a cog
+    loop still running after its cog released the client on unload.
+    """
+    pass
+
+class HttpResponse():
+    """
+    A fully read response. The body is read before it is handed back, so the
+    connection is already back in the pool by the time callers see it.
+    """
+
+    def __init__(self, status, url, history, headers, body):
+        self.status = status
+        self.url = url
+        self.history = history
+        self.headers = headers
+        self.body = body
+
+    async def text(self):
+        return self.body
+
+class HostMetrics():
+    """
+    Request counts and latency for a single host.
+    """
+
+    def __init__(self, window=200):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def record(self, latency, error):
+        self.requests += 1
+        if error:
+            self.errors += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.recent.append(latency)
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "average": self.total_latency / self.requests if self.requests else 0.0,
+            "p95": self.percentile(0.95),
+            "max": self.max_latency
+        }
+
+class HttpClient():
+    """
+    One pooled aiohttp session shared by every cog.
+
+    Connections are bounded overall (`limit`) and per host (`limit_per_host`), DNS
+    lookups are cached, every request gets a default timeout, and failed or
+    retryable responses are retried with exponential backoff and jitter.
+
+    The per-host limit is a semaphore every request to that host waits on, before
+    its timeout starts. A cog that bounds its own concurrency against one host
+    should raise that host's limit to match with `set_host_limit`, or the client's
+    default quietly becomes the real cap.
+    """
+
+    def __init__(self, limit=50, limit_per_host=8, timeout=15, retries=2, backoff=0.5, dns_ttl=300):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.dns_ttl = dns_ttl
+        self.session = None
+        self.closed = False
+        self.host_limits = {}
+        self.host_limit_sizes = {}
+        self.metrics = {}
+        self.users = set()
+
+    def ensure_session(self):
+        if self.closed:
+            raise ClientClosed("The shared HTTP client has been closed")
+        if self.session is None or self.session.closed:
+            try:
+                connector = aiohttp.TCPConnector(limit=self.limit, use_dns_cache=True, ttl_dns_cache=self.dns_ttl)
+            except TypeError:
+                #Older aiohttp has no DNS TTL and caches lookups for the life of the connector.
+                connector = aiohttp.TCPConnector(limit=self.limit, use_dns_cache=True)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    def host_limit(self, host):
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.host_limit_sizes.get(host, self.limit_per_host))
+        return self.host_limits[host]
+
+    def set_host_limit(self, host, limit):
+        """
+        Allows up to `limit` concurrent requests to `host`. Requests already holding a
+        slot finish under the old limit.
+        """
+        if self.host_limit_sizes.get(host) == limit:
+            return
+        self.host_limit_sizes[host] = limit
+        self.host_limits.pop(host, None)
+
+    def metrics_for(self, host):
+        if host not in self.metrics:
+            self.metrics[host] = HostMetrics()
+        return self.metrics[host]
+
+    async def fetch(self, method, url, headers, data):
+        async with self.ensure_session().request(method, url, headers=headers, data=data) as resp:
+            body = await resp.text()
+            return HttpResponse(resp.status, str(resp.url), tuple(resp.history), dict(resp.headers), body)
+
+    async def request(self, method, url, headers=None, data=None, timeout=None, retries=None):
+        """
+        Makes a request and returns an HttpResponse. Connection errors, timeouts and
+        RETRY_STATUSES are retried; the last error is raised, or the last response
+        returned, once `retries` runs out.
+        """
+        if self.closed:
+            raise ClientClosed("The shared HTTP client has been closed")
+        host = urlparse(url).hostname
+        metrics = self.metrics_for(host)
+        attempts = (self.retries if retries is None else retries) + 1
+        for attempt in range(attempts):
+            if attempt > 0:
+                metrics.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            async with self.host_limit(host):
+                started = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(
+                        self.fetch(method, url, headers, data), timeout or self.timeout)
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                    metrics.record(time.monotonic() - started, True)
+                    if attempt + 1 >= attempts:
+                        raise
+                    continue
+            metrics.record(time.monotonic() - started, response.status >= 500)
+            if response.status not in RETRY_STATUSES or attempt + 1 >= attempts:
+                return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def close(self):
+        self.closed = True
+        if self.session is None:
+            return
+        session, self.session = self.session, None
+        closing = session.close()
+        if inspect.isawaitable(closing):
+            await closing
+
+_client = None
+
+def acquire_client(user):
+    """
+    Returns the shared HttpClient, registering `user` (usually the cog name) as one of its users.
+    """
+    global _client
+    if _client is None:
+        _client = HttpClient()
+    _client.users.add(user)
+    return _client
+
+def release_client(user):
+    """
+    Unregisters `user`. When the last user is gone the pooled session is closed.
+    """
+    global _client
+    if _client is None:
+        return
+    _client.users.discard(user)
+    if not _client.users:
+        #Closed straight away, so nothing can open a new session before close() runs.
+        _client.closed = True
+        asyncio.ensure_future(_client.close())
+        _client = None
+
+class HttpClientStats:
+    """
+    Shows metrics for the HTTP client shared by the hoggit cogs
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.http = acquire_client("http_client")
+
+    def __unload(self):
+        release_client("http_client")
+
+    @commands.command(name="httpstats")
+    @checks.is_owner()
+    async def _httpstats(self):
+        """Shows request counts, errors and latency per host"""
+        if not self.http.metrics:
+            await self.bot.say("No requests made yet")
+            return
+        lines = ["Cogs using the client: {}".format(", ".join(sorted(self.http.users)))]
+        for host, metrics in sorted(self.http.metrics.items()):
+            lines.append(
+                "{host}: {requests} requests, {errors} errors, {retries} retries, "
+                "avg {average:.0f}ms, p95 {p95:.0f}ms, max {max:.0f}ms".format(
+                    host=host,
+                    **{k: v * 1000 if k in ("average", "p95", "max") else v for k, v in metrics.summary().items()}))
+        for page in pagify("\n".join(lines)):
+            await self.bot.say(box(page))
+
+def setup(bot):
+    bot.add_cog(HttpClientStats(bot))
@@ -1,20 +1,533 @@
 import asyncio
+import array
+import struct
+import sys
 import discord
 from discord.ext import commands
-from .utils.chat_formatting import pagify
+from .utils.chat_formatting import pagify, box
 from .utils import checks
 from .utils.dataIO import dataIO
+from .http_client import acquire_client, release_client
 import json
-import aiohttp
 import datetime
+import time
+import copy
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import collections
+import itertools
+import random
 import os
 import arrow
 from bs4 import BeautifulSoup
+from urllib.parse import urlparse
+
+EmbedSnapshot = collections.namedtuple("EmbedSnapshot", [
+    "fingerprint", "health", "color", "server_name", "fields", "since_status", "since_time", "update_time"])
+
+DEFAULT_SETTINGS = {
+    "poll_concurrency": 10,
+    "poll_timeout_seconds": 10,
+    "status_cache_ttl_seconds": 10,
+    "poll_busy_interval_seconds": 5,
+    "poll_idle_interval_seconds": 30,
+    "poll_backoff_max_seconds": 300,
+    "history_capacity": 7 * 24 * 60,
+    "history_sample_seconds": 60,
+    "history_checkpoint_seconds": 600,
+    "presence_rotation_seconds": 15,
+    "presence_min_interval_seconds": 12,
+    "alert_channel": None,
+    "alert_settle_seconds": 120,
+    "alert_batch_seconds": 60
+}
 
 class ErrorGettingStatus(Exception):
     def __init__(self, statusCode):
         self.status=statusCode
 
+class UptimeStore():
+    """
+    In-memory copy of each server's last status transition ("status" and "time").
+
+    Transitions live alongside the keys in server.json, so the store shares the
+    cog's `key_data` dict. Changes are written back in the background, batched
+    into one write every `flush_delay` seconds. Every write of server.json, key
+    changes included, goes through `write` so they land in the order they were made.
+    """
+
+    def __init__(self, file_path, data, flush_delay=5):
+        self.file_path = file_path
+        self.data = data
+        self.flush_delay = flush_delay
+        self.pending_flush = None
+        self.writer = ThreadPoolExecutor(max_workers=1)
+
+    def get(self, server_key):
+        if server_key not in self.data:
+            return {}
+        return self.data[server_key]
+
+    def record(self, server_key, status, time):
+        if server_key not in self.data:
+            return
+        self.data[server_key]["status"] = status
+        self.data[server_key]["time"] = time.for_json()
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.pending_flush is None:
+            self.pending_flush = asyncio.ensure_future(self.delayed_flush())
+
+    async def delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        #Anything recorded from here on needs another flush.
+        self.pending_flush = None
+        self.write()
+
+    def write(self):
+        """
+        Queues a write of the current data behind any write already running, and
+        cancels the batched flush, which this write covers.
+        """
+        if self.pending_flush is not None:
+            self.pending_flush.cancel()
+            self.pending_flush = None
+        future = self.writer.submit(dataIO.save_json, self.file_path, copy.deepcopy(self.data))
+        future.add_done_callback(self.written)
+        return future
+
+    @staticmethod
+    def written(future):
+        if future.exception() is not None:
+            print("Server Status: Failed to write server data: ", future.exception())
+
+    def flush(self):
+        """
+        Writes any pending changes and waits for every queued write. Used when the cog unloads.
+        """
+        if self.pending_flush is not None:
+            self.write()
+        self.writer.shutdown(wait=True)
+
+class StatusCache():
+    """
+    Short-lived cache of server statuses keyed by alias.
+
+    The background poller refreshes entries with `put`. Lookups that miss fetch
+    upstream, and concurrent lookups for the same alias share that one request.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def put(self, alias, status):
+        self.entries[alias] = (status, time.monotonic())
+
+    def discard(self, alias):
+        self.entries.pop(alias, None)
+
+    def fresh(self, alias):
+        if alias not in self.entries:
+            return None
+        status, stored_at = self.entries[alias]
+        if time.monotonic() - stored_at > self.ttl:
+            return None
+        return status
+
+    async def get(self, alias, fetch):
+        """
+        Returns the cached status for `alias`, calling the `fetch` coroutine function
+        only when the entry is missing or expired and no fetch is already running.
+        """
+        status = self.fresh(alias)
+        if status is not None:
+            self.hits += 1
+            return status
+        if alias in self.in_flight:
+            self.coalesced += 1
+            return await asyncio.shield(self.in_flight[alias])
+        self.misses += 1
+        future = asyncio.ensure_future(fetch())
+        self.in_flight[alias] = future
+        future.add_done_callback(lambda f: self.fetched(alias, f))
+        return await asyncio.shield(future)
+
+    def fetched(self, alias, future):
+        if self.in_flight.get(alias) is future:
+            del self.in_flight[alias]
+        if not future.cancelled() and future.exception() is None:
+            self.put(alias, future.result())
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        saved = self.hits + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self.entries),
+            "saved_ratio": saved / lookups if lookups else 0.0
+        }
+
+class PollScheduler():
+    """
+    Decides when each server is polled next, based on what its last poll returned.
+
+    Populated servers are polled every `busy_interval` seconds and empty ones every
+    `idle_interval`. Servers that error or report as offline back off exponentially
+    from `idle_interval` up to `max_backoff`. Every delay gets +/- `jitter` applied
+    so servers don't line up. Due times live in a heap; entries superseded by a
+    later reschedule are skipped when they reach the top.
+    """
+
+    def __init__(self, busy_interval, idle_interval, max_backoff, jitter=0.2):
+        self.busy_interval = busy_interval
+        self.idle_interval = idle_interval
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.heap = []
+        self.due = {}
+        self.failures = {}
+        self.counter = itertools.count()
+
+    def schedule(self, alias, delay):
+        due = time.monotonic() + delay
+        self.due[alias] = due
+        heapq.heappush(self.heap, (due, next(self.counter), alias))
+
+    def remove(self, alias):
+        self.due.pop(alias, None)
+        self.failures.pop(alias, None)
+
+    def sync(self, aliases):
+        """
+        Schedules newly tracked servers right away and forgets removed ones.
+        """
+        for alias in aliases:
+            if alias not in self.due:
+                self.schedule(alias, 0)
+        for alias in list(self.due.keys()):
+            if alias not in aliases:
+                self.remove(alias)
+
+    def pop_due(self):
+        now = time.monotonic()
+        due_aliases = []
+        while self.heap and self.heap[0][0] <= now:
+            due, _, alias = heapq.heappop(self.heap)
+            if self.due.get(alias) == due:
+                due_aliases.append(alias)
+        return due_aliases
+
+    def jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def record_success(self, alias, players):
+        if alias not in self.due:
+            return
+        self.failures[alias] = 0
+        interval = self.busy_interval if players > 0 else self.idle_interval
+        self.schedule(alias, self.jittered(interval))
+
+    def record_failure(self, alias):
+        if alias not in self.due:
+            return
+        streak = self.failures.get(alias, 0) + 1
+        self.failures[alias] = streak
+        delay = min(self.idle_interval * 2 ** (streak - 1), self.max_backoff)
+        self.schedule(alias, self.jittered(delay))
+
+    def seconds_until_next(self):
+        """
+        Seconds until the earliest scheduled poll, or None if nothing is scheduled.
+        """
+        while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0)
+
+    def seconds_until_due(self, alias):
+        if alias not in self.due:
+            return None
+        return max(self.due[alias] - time.monotonic(), 0)
+
+class PlayerHistory():
+    """
+    Fixed-size ring buffer of (update time, player count, mission) samples for one server.
+
+    Samples live in preallocated `array`s, so memory use depends only on `capacity`.
+    Mission names are interned into a small table and stored as indexes. The indexes
+    and the table length are 16-bit, so `capacity` must not exceed MAX_CAPACITY.
+    """
+
+    MAX_CAPACITY = 0xFFFF
+    SPARK_CHARS = "\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array.array("q", [0]) * capacity
+        self.players = array.array("H", [0]) * capacity
+        self.mission_ids = array.array("H", [0]) * capacity
+        self.missions = []
+        self.mission_index = {}
+        self.count = 0
+        self.head = 0
+
+    def last_time(self):
+        if self.count == 0:
+            return None
+        return self.times[(self.head - 1) % self.capacity]
+
+    def record(self, timestamp, players, mission):
+        self.times[self.head] = int(timestamp)
+        self.players[self.head] = max(0, min(players, 0xFFFF))
+        self.mission_ids[self.head] = self.mission_id(mission)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def mission_id(self, mission):
+        if mission not in self.mission_index:
+            if len(self.missions) >= min(self.capacity, self.MAX_CAPACITY):
+                self.compact_missions()
+            self.mission_index[mission] = len(self.missions)
+            self.missions.append(mission)
+        return self.mission_index[mission]
+
+    def compact_missions(self):
+        """
+        Drops mission names that no sample refers to anymore. When the buffer is full
+        the oldest sample is about to be overwritten, so its mission does not count.
+        """
+        live = self.ordered(self.mission_ids)
+        if self.count == self.capacity:
+            live = live[1:]
+        used = sorted(set(live))
+        remap = {}
+        missions = []
+        for old_id in used:
+            remap[old_id] = len(missions)
+            missions.append(self.missions[old_id])
+        for i in range(self.capacity):
+            self.mission_ids[i] = remap.get(self.mission_ids[i], 0)
+        self.missions = missions
+        self.mission_index = {mission: i for i, mission in enumerate(missions)}
+
+    def ordered(self, values):
+        """
+        Returns a copy of `values` ordered oldest sample first.
+        """
+        if self.count < self.capacity:
+            return values[:self.count]
+        return values[self.head:] + values[:self.head]
+
+    def sparkline(self, players, width):
+        if not players:
+            return ""
+        width = min(width, len(players))
+        averages = []
+        for i in range(width):
+            bucket = players[i * len(players) // width:(i + 1) * len(players) // width]
+            averages.append(sum(bucket) / len(bucket))
+        top = max(averages) or 1
+        levels = len(self.SPARK_CHARS) - 1
+        return "".join(self.SPARK_CHARS[int(round(average / top * levels))] for average in averages)
+
+    def summary(self, spark_width=28):
+        """
+        Returns peak, average, busiest hour (UTC) and a sparkline over every stored sample,
+        or None if nothing has been recorded yet.
+        """
+        if self.count == 0:
+            return None
+        times = self.ordered(self.times)
+        players = self.ordered(self.players)
+        peak = max(players)
+        peak_index = players.index(peak)
+        hour_totals = [0] * 24
+        hour_counts = [0] * 24
+        for hour, count in zip((t // 3600 % 24 for t in times), players):
+            hour_totals[hour] += count
+            hour_counts[hour] += 1
+        hour_averages = [total / count if count else -1 for total, count in zip(hour_totals, hour_counts)]
+        busiest_hour = hour_averages.index(max(hour_averages))
+        return {
+            "samples": self.count,
+            "start": times[0],
+            "end": times[-1],
+            "peak": peak,
+            "peak_time": times[peak_index],
+            "peak_mission": self.missions[self.ordered(self.mission_ids)[peak_index]],
+            "average": sum(players) / len(players),
+            "busiest_hour": busiest_hour,
+            "busiest_hour_average": hour_averages[busiest_hour],
+            "sparkline": self.sparkline(players, spark_width)
+        }
+
+    def to_bytes(self):
+        parts = [struct.pack("<IIIH", self.capacity, self.count, self.head, len(self.missions))]
+        for mission in self.missions:
+            encoded = mission.encode("utf-8")[:0xFFFF]
+            parts.append(struct.pack("<H", len(encoded)))
+            parts.append(encoded)
+        for values in (self.times, self.players, self.mission_ids):
+            if sys.byteorder == "big":
+                values = array.array(values.typecode, values)
+                values.byteswap()
+            parts.append(values.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, buffer, offset, capacity):
+        """
+        Reads one history written by `to_bytes` starting at `offset`.
+        Returns the history and the offset just past it.
+        """
+        stored_capacity, count, head, mission_count = struct.unpack_from("<IIIH", buffer, offset)
+        offset += struct.calcsize("<IIIH")
+        stored = cls(stored_capacity)
+        for _ in range(mission_count):
+            length, = struct.unpack_from("<H", buffer, offset)
+            offset += 2
+            stored.missions.append(bytes(buffer[offset:offset + length]).decode("utf-8", "replace"))
+            offset += length
+        stored.mission_index = {mission: i for i, mission in enumerate(stored.missions)}
+        for values in (stored.times, stored.players, stored.mission_ids):
+            size = stored_capacity * values.itemsize
+            values[:] = array.array(values.typecode, bytes(buffer[offset:offset + size]))
+            if sys.byteorder == "big":
+                values.byteswap()
+            offset += size
+        stored.count = count
+        stored.head = head
+        if stored_capacity == capacity:
+            return stored, offset
+        #Capacity changed since the checkpoint, keep the most recent samples that fit.
+        history = cls(capacity)
+        times = stored.ordered(stored.times)
+        players = stored.ordered(stored.players)
+        mission_ids = stored.ordered(stored.mission_ids)
+        start = max(len(times) - capacity, 0)
+        for i in range(start, len(times)):
+            history.record(times[i], players[i], stored.missions[mission_ids[i]])
+        return history, offset
+
+HISTORY_MAGIC = b"HGSH"
+HISTORY_VERSION = 1
+
+def dump_histories(histories):
+    parts = [HISTORY_MAGIC, struct.pack("<BI", HISTORY_VERSION, len(histories))]
+    for alias, history in histories.items():
+        encoded = alias.encode("utf-8")
+        parts.append(struct.pack("<H", len(encoded)))
+        parts.append(encoded)
+        parts.append(history.to_bytes())
+    return b"".join(parts)
+
+def load_histories(path, capacity):
+    histories = {}
+    if not os.path.exists(path):
+        return histories
+    with open(path, "rb") as f:
+        buffer = f.read()
+    if buffer[:4] != HISTORY_MAGIC:
+        print("Server Status: Ignoring unrecognised history file ", path)
+        return histories
+    version, server_count = struct.unpack_from("<BI", buffer, 4)
+    offset = 4 + struct.calcsize("<BI")
+    for _ in range(server_count):
+        length, = struct.unpack_from("<H", buffer, offset)
+        offset += 2
+        alias = buffer[offset:offset + length].decode("utf-8")
+        offset += length
+        histories[alias], offset = PlayerHistory.from_bytes(buffer, offset, capacity)
+    return histories
+
+def write_history_file(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class PresenceManager():
+    """
+    Sends the bot's presence to Discord. A presence identical to the one already
+    showing is never re-sent, and a change arriving less than `min_interval`
+    seconds after the previous one is dropped; the next rotation tick retries
+    with fresh data.
+    """
+
+    def __init__(self, bot, min_interval):
+        self.bot = bot
+        self.min_interval = min_interval
+        self.current = None
+        self.last_sent = None
+        self.sent = 0
+        self.unchanged = 0
+        self.throttled = 0
+
+    async def update(self, status, game):
+        presence = (status, game)
+        if presence == self.current:
+            self.unchanged += 1
+            return False
+        now = time.monotonic()
+        if self.last_sent is not None and now - self.last_sent < self.min_interval:
+            self.throttled += 1
+            return False
+        await self.bot.change_presence(status=status, game=discord.Game(name=game))
+        self.current = presence
+        self.last_sent = now
+        self.sent += 1
+        return True
+
+class TransitionAlerts():
+    """
+    Collects the health transitions the poller sees and decides which ones to report.
+
+    A new state has to hold for `settle_seconds` before it is reported. A server
+    that flaps and returns to its last reported state produces no alert at all.
+    """
+
+    def __init__(self, settle_seconds):
+        self.settle_seconds = settle_seconds
+        self.reported = {}
+        self.pending = {}
+
+    def observe(self, alias, status, baseline=None):
+        if alias not in self.reported:
+            self.reported[alias] = baseline or status
+        if status == self.reported[alias]:
+            self.pending.pop(alias, None)
+            return
+        if alias not in self.pending or self.pending[alias][0] != status:
+            self.pending[alias] = (status, time.monotonic(), arrow.utcnow())
+
+    def remove(self, alias):
+        self.reported.pop(alias, None)
+        self.pending.pop(alias, None)
+
+    def settled(self):
+        """
+        Returns (alias, old status, new status, changed at) for each transition that
+        has settled since the last call, and marks them as reported.
+        """
+        now = time.monotonic()
+        changes = []
+        for alias, (status, since, changed_at) in list(self.pending.items()):
+            if now - since >= self.settle_seconds:
+                changes.append((alias, self.reported[alias], status, changed_at))
+                self.reported[alias] = status
+                del self.pending[alias]
+        return changes
+
 class ServerHealth():
     """
     Returns a ServerHealth with a health status string indicating "Online", "Unhealthy", "Offline"
@@ -24,27 +537,26 @@ class ServerHealth():
     Red - Offline
     """
 
-    def __init__(self, updateTime, server_key):
-        self.uptime_file = "data/server_status/server.json"
-        self.uptime_data = dataIO.load_json(self.uptime_file)
-        self.status = self.determine_status(updateTime, self.uptime_data[server_key], server_key)
+    def __init__(self, updateTime, server_key, uptime_store):
+        self.uptime_store = uptime_store
+        uptime_data = self.uptime_store.get(server_key)
+        self.status = self.determine_status(updateTime, uptime_data, server_key)
         self.color = self.determine_color(self.status)
-        self.uptime = self.determine_uptime(self.status, self.uptime_data[server_key])
+        self.uptime = self.determine_uptime(self.status, self.uptime_store.get(server_key))
 
     def determine_status(self, updateTime, uptime_data, server_key):
         now = arrow.utcnow()
         status = "Online"
-        if "status" not in uptime_data:
-            uptime_data["status"] = ""
         if (updateTime < now.shift(seconds=-60)):
             status = "Unhealthy"
         if (updateTime < now.shift(seconds=-100)):
             status = "Offline"
-        if status != uptime_data["status"]:
-            self.store_uptime(status, updateTime, server_key)
+        if status != uptime_data.get("status", ""):
+            self.uptime_store.record(server_key, status, updateTime)
         return status
 
-    def determine_color(self, status):
+    @staticmethod
+    def determine_color(status):
         if (status == "Online"):
             return 0x05e400
         if (status == "Unhealthy"):
@@ -52,22 +564,13 @@ class ServerHealth():
         return 0xFF0000
 
     def determine_uptime(self, status, uptime_data):
-        now = arrow.utcnow()
-        if "status" not in self.get_uptime():
-            return self.determine_delta(now, uptime_data["time"])
-        if self.get_uptime()['status'] == status:
-            current_uptime = self.determine_delta(now, uptime_data["time"])
-            return current_uptime
-
-    def get_uptime(self):
-        return dataIO.load_json(self.uptime_file)
-
-    def store_uptime(self, status, time, server_key):
-        self.uptime_data[server_key]["status"] = status
-        self.uptime_data[server_key]["time"] = time.for_json()
-        dataIO.save_json(self.uptime_file, self.uptime_data)
+        if "time" not in uptime_data:
+            return None
+        if uptime_data.get("status", status) == status:
+            return self.determine_delta(arrow.utcnow(), uptime_data["time"])
 
-    def determine_delta(self, current, change):
+    @staticmethod
+    def determine_delta(current, change):
         delta = current - arrow.get(change)
         days = delta.days
         hours,remainder = divmod(delta.seconds,3600)
@@ -83,23 +586,87 @@ class DCSServerStatus:
 
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self.http = acquire_client("server_status")
         self.key_file = "data/server_status/server.json"
         self.key_data = dataIO.load_json(self.key_file)
+        self.uptime_store = UptimeStore(self.key_file, self.key_data)
+        self.settings_file = "data/server_status/settings.json"
+        self.settings = dataIO.load_json(self.settings_file)
+        self.status_cache = StatusCache(self.get_setting("status_cache_ttl_seconds"))
+        self.scheduler = PollScheduler(
+            self.get_setting("poll_busy_interval_seconds"),
+            self.get_setting("poll_idle_interval_seconds"),
+            self.get_setting("poll_backoff_max_seconds"))
         self.base_url = "https://status.hoggitworld.com/"
         self.killPoll = False
         self.last_key_checked = None
+        #Latest poll result for every tracked server, keyed by alias.
+        self.status_table = {}
+        #Latest pre-rendered `!server` embed for every tracked server, keyed by alias.
+        self.embed_snapshots = {}
+        self.history_file = "data/server_status/history.bin"
+        try:
+            self.histories = load_histories(self.history_file, self.history_capacity())
+        except Exception as e:
+            print("Server Status: Could not load player history, starting fresh: ", e)
+            self.histories = {}
+        self.transitions = TransitionAlerts(self.get_setting("alert_settle_seconds"))
+        self.presence = PresenceManager(self.bot, self.get_setting("presence_min_interval_seconds"))
+        #Upper bound on how long the poll loop sleeps, so newly added servers get picked up.
+        self.max_poll_sleep_seconds = 5
+        #Each due server is polled in its own task, so a slow one never holds up the rest.
+        self.poll_tasks = {}
+        self.poll_slots = None
+        self.poll_slots_size = None
+        self.poll_wakeup = asyncio.Event()
         self.start_polling()
-        self.presence_cycle_time_seconds = 5
 
     def __unload(self):
         #kill the polling
         self.killPoll = True
+        for task in self.poll_tasks.values():
+            task.cancel()
+        self.uptime_store.flush()
+        try:
+            write_history_file(self.history_file, dump_histories(self.histories))
+        except Exception as e:
+            print("Server Status: Failed to save player history: ", e)
+        release_client("server_status")
 
     def start_polling(self):
         asyncio.ensure_future(self.poll())
+        asyncio.ensure_future(self.rotate_presence())
+        asyncio.ensure_future(self.send_alerts())
+        asyncio.ensure_future(self.checkpoint_history())
         print("Server Status polling started")
 
+    def history_capacity(self):
+        return min(self.get_setting("history_capacity"), PlayerHistory.MAX_CAPACITY)
+
+    def record_history(self, alias, status):
+        if alias not in self.histories:
+            self.histories[alias] = PlayerHistory(self.history_capacity())
+        history = self.histories[alias]
+        update_time = arrow.get(status["data"]["updateTime"]).datetime.timestamp()
+        last_time = history.last_time()
+        if last_time is not None and update_time - last_time < self.get_setting("history_sample_seconds"):
+            return
+        history.record(update_time, status["players"], status["missionName"])
+
+    async def checkpoint_history(self):
+        await asyncio.sleep(self.get_setting("history_checkpoint_seconds"))
+        if self.killPoll:
+            return
+        try:
+            data = dump_histories(self.histories)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, write_history_file, self.history_file, data)
+        except Exception as e:
+            print("Server Status: Failed to checkpoint player history: ", e)
+        finally:
+            if not self.killPoll:
+                asyncio.ensure_future(self.checkpoint_history())
+
     def get_next_key(self):
         key = None
         if not self.last_key_checked:
@@ -122,24 +689,155 @@ class DCSServerStatus:
         return key
 
 
+    def get_setting(self, name):
+        if name in self.settings:
+            return self.settings[name]
+        return DEFAULT_SETTINGS[name]
+
+    def save_settings(self):
+        dataIO.save_json(self.settings_file, self.settings)
+
+    async def poll_server(self, alias, semaphore):
+        """
+        Fetches the status of a single server into the status table.
+        """
+        async with semaphore:
+            if alias not in self.key_data:
+                return
+            entry = {"status": None, "error": None, "fetched": arrow.utcnow()}
+            try:
+                entry["status"] = await asyncio.wait_for(
+                    self.get_status(self.key_data[alias]["key"]),
+                    self.get_setting("poll_timeout_seconds"))
+            except ErrorGettingStatus as e:
+                entry["error"] = "HTTP {}".format(e.status)
+            except asyncio.TimeoutError:
+                entry["error"] = "Timed out"
+            except Exception as e:
+                entry["error"] = str(e)
+            if entry["status"] is not None:
+                self.status_cache.put(alias, entry["status"])
+                self.record_history(alias, entry["status"])
+                if self.is_offline(entry["status"]):
+                    self.scheduler.record_failure(alias)
+                else:
+                    self.scheduler.record_success(alias, entry["status"]["players"])
+            else:
+                self.scheduler.record_failure(alias)
+            if entry["status"] is None and alias in self.status_table:
+                #Keep the last good status around so we don't lose the server on a single failure.
+                entry["status"] = self.status_table[alias]["status"]
+            self.status_table[alias] = entry
+            if entry["status"] is not None:
+                baseline = self.uptime_store.get(alias).get("status")
+                snapshot = self.snapshot_for(alias, entry["status"])
+                self.transitions.observe(alias, snapshot.health, baseline)
+
+    def is_offline(self, status):
+        last_update = arrow.get(status["data"]["updateTime"])
+        return last_update < arrow.utcnow().shift(seconds=-100)
+
+    def poll_due(self):
+        """
+        Starts a poll for every server the scheduler says is due, each in its own task,
+        without waiting for them. At most `poll_concurrency` run at once.
+        """
+        self.scheduler.sync(self.key_data)
+        concurrency = self.get_setting("poll_concurrency")
+        if concurrency != self.poll_slots_size:
+            #Polls already running finish under the old limit.
+            self.poll_slots = asyncio.Semaphore(concurrency)
+            self.poll_slots_size = concurrency
+        #Every poll goes to one host, so the shared client's per-host limit has to
+        #be at least poll_concurrency or it would be the real cap.
+        self.http.set_host_limit(urlparse(self.base_url).hostname, concurrency)
+        for alias in self.scheduler.pop_due():
+            if alias in self.poll_tasks:
+                continue
+            task = asyncio.ensure_future(self.poll_server(alias, self.poll_slots))
+            self.poll_tasks[alias] = task
+            task.add_done_callback(functools.partial(self.poll_done, alias))
+        for alias in list(self.status_table.keys()):
+            if alias not in self.key_data:
+                del self.status_table[alias]
+
+    def poll_done(self, alias, task):
+        self.poll_tasks.pop(alias, None)
+        if not task.cancelled() and task.exception() is not None:
+            print("Server Status: Polling {} failed: ".format(alias), task.exception())
+        #The server has been rescheduled, possibly sooner than the poll loop planned to wake.
+        self.poll_wakeup.set()
+
     async def poll(self):
         try:
-            key = self.get_next_key()
-            if key == None:
-                return #still runs finally
-            else:
-                data = self.key_data[key]
-                status = await self.get_status(data["key"])
-                await self.set_presence(status, key)
+            self.poll_due()
         except Exception as e:
             print("Server Status poll encountered an error. skipping this poll: ", e)
         finally:
             if self.killPoll:
                 print("Server Status poll killswitch received. Not scheduling another poll")
                 return
-            await asyncio.sleep(self.presence_cycle_time_seconds)
+            delay = self.scheduler.seconds_until_next()
+            if delay is None or delay > self.max_poll_sleep_seconds:
+                delay = self.max_poll_sleep_seconds
+            self.poll_wakeup.clear()
+            try:
+                await asyncio.wait_for(self.poll_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
             asyncio.ensure_future(self.poll())
 
+    def format_transitions(self, changes):
+        statuses = set(new for _, _, new, _ in changes)
+        color = ServerHealth.determine_color("Online")
+        if "Offline" in statuses:
+            color = ServerHealth.determine_color("Offline")
+        elif "Unhealthy" in statuses:
+            color = ServerHealth.determine_color("Unhealthy")
+        embed = discord.Embed(title="Server status changes", color=color)
+        for alias, old, new, changed_at in changes[:25]:
+            name = self.key_data[alias]["alias"] if alias in self.key_data else alias
+            embed.add_field(name=name, value="{} -> {} ({})".format(old or "Unknown", new, changed_at.humanize()), inline=False)
+        if len(changes) > 25:
+            embed.set_footer(text="And {} more changes omitted".format(len(changes) - 25))
+        return embed
+
+    async def send_alerts(self):
+        """
+        Posts every settled transition since the last batch as one embed to the alert channel.
+        """
+        try:
+            await self.bot.wait_until_ready()
+            changes = [c for c in self.transitions.settled() if c[0] in self.key_data]
+            channel_id = self.get_setting("alert_channel")
+            channel = self.bot.get_channel(channel_id) if channel_id else None
+            if changes and channel:
+                await self.bot.send_message(channel, embed=self.format_transitions(changes))
+        except Exception as e:
+            print("Server Status: Failed to send status alerts: ", e)
+        finally:
+            if self.killPoll:
+                return
+            await asyncio.sleep(self.get_setting("alert_batch_seconds"))
+            asyncio.ensure_future(self.send_alerts())
+
+    async def rotate_presence(self):
+        """
+        Shows the next tracked server in the bot's presence. Runs on its own cadence,
+        independent of how often servers are polled.
+        """
+        try:
+            key = self.get_next_key()
+            if key is not None and key in self.status_table and self.status_table[key]["status"]:
+                await self.set_presence(self.status_table[key]["status"], key)
+        except Exception as e:
+            print("Server Status presence rotation encountered an error: ", e)
+        finally:
+            if self.killPoll:
+                return
+            await asyncio.sleep(self.get_setting("presence_rotation_seconds"))
+            asyncio.ensure_future(self.rotate_presence())
+
 
     def store_key(self, key):
         self.key_data[key["alias"].lower()] = key
@@ -148,10 +846,15 @@ class DCSServerStatus:
     def delete_key(self, alias):
         if alias.lower() in self.key_data:
             del self.key_data[alias.lower()]
+            self.status_cache.discard(alias.lower())
+            self.histories.pop(alias.lower(), None)
+            self.transitions.remove(alias.lower())
+            self.embed_snapshots.pop(alias.lower(), None)
             self.save_key_data(self.key_data)
 
     def save_key_data(self, key_data):
-        dataIO.save_json(self.key_file, key_data)
+        #Shares server.json with the uptime store, so it goes through the same ordered writer.
+        self.uptime_store.write()
 
     async def set_presence(self, status, server_key):
         await self.bot.wait_until_ready()
@@ -165,11 +868,11 @@ class DCSServerStatus:
         elif health.status == "Offline":
             bot_status=discord.Status.dnd
             game="{} Server offline".format(server_data["alias"])
-        await self.bot.change_presence(status=bot_status, game=discord.Game(name=game))
+        await self.presence.update(bot_status, game)
 
     async def get_status(self, key):
         url = self.base_url + key
-        resp = await self.session.get(url)
+        resp = await self.http.get(url)
         if (resp.status != 200):
             raise ErrorGettingStatus(resp.status)
         status = json.loads(await resp.text())
@@ -180,7 +883,7 @@ class DCSServerStatus:
 
     def determine_health(self, status, server_key):
         last_update = arrow.get(status["data"]["updateTime"])
-        return ServerHealth(last_update, server_key)
+        return ServerHealth(last_update, server_key, self.uptime_store)
 
     def humanize_time(self, updateTime):
         arrowtime = arrow.get(updateTime)
@@ -197,23 +900,65 @@ class DCSServerStatus:
                 return metar
         return "Unavailable"
 
-    def embedMessage(self, status, alias):
+    def status_fingerprint(self, status, health):
+        return (
+            status["data"]["updateTime"], status["updateTime"], status["serverName"],
+            status["missionName"], status["map"], status["players"], status["maxPlayers"],
+            self.get_metar(status), health.status)
+
+    def snapshot_for(self, alias, status):
+        """
+        Returns the pre-rendered embed for this status, rendering and storing a new
+        one only if the status (or the server's health) changed since the last render.
+        """
         health = self.determine_health(status, alias)
-        embed=discord.Embed(color=health.color)
-        embed.set_author(name=status["serverName"], icon_url="https://i.imgur.com/KEd7OQJ.png")
-        embed.set_thumbnail(url="https://i.imgur.com/KEd7OQJ.png")
-        embed.add_field(name="Status", value=health.status, inline=True)
-        embed.add_field(name="Mission", value=status["missionName"], inline=True)
-        embed.add_field(name="Map", value=status["map"], inline=True)
-        embed.add_field(name="Players", value="{}/{}".format(status["players"], status["maxPlayers"]), inline=True)
-        embed.add_field(name="METAR", value=self.get_metar(status))
+        fingerprint = self.status_fingerprint(status, health)
+        current = self.embed_snapshots.get(alias)
+        if current is not None and current.fingerprint == fingerprint:
+            return current
+        fields = (
+            ("Status", health.status, True),
+            ("Mission", status["missionName"], True),
+            ("Map", status["map"], True),
+            ("Players", "{}/{}".format(status["players"], status["maxPlayers"]), True),
+            ("METAR", self.get_metar(status), True))
+        since_status = None
         if health.status == "Online":
-            embed.add_field(name="Mission Time", value=self.get_mission_time(status), inline=True)
+            fields += (("Mission Time", self.get_mission_time(status), True),)
         else:
-            embed.add_field(name="{} Since".format(health.status), value=health.uptime, inline=True)
-        embed.set_footer(text="Last update: {} -- See my status light for up-to-date status.".format(self.humanize_time(status["updateTime"])))
+            since_status = health.status
+        snapshot = EmbedSnapshot(
+            fingerprint=fingerprint,
+            health=health.status,
+            color=health.color,
+            server_name=status["serverName"],
+            fields=fields,
+            since_status=since_status,
+            since_time=self.uptime_store.get(alias).get("time"),
+            update_time=status["updateTime"])
+        self.embed_snapshots[alias] = snapshot
+        return snapshot
+
+    def render_snapshot(self, snapshot):
+        """
+        Builds the embed for a snapshot. Only the relative-time fields are computed here.
+        """
+        embed=discord.Embed(color=snapshot.color)
+        embed.set_author(name=snapshot.server_name, icon_url="https://i.imgur.com/KEd7OQJ.png")
+        embed.set_thumbnail(url="https://i.imgur.com/KEd7OQJ.png")
+        for name, value, inline in snapshot.fields:
+            embed.add_field(name=name, value=value, inline=inline)
+        if snapshot.since_status:
+            since = "Unknown"
+            if snapshot.since_time:
+                since = ServerHealth.determine_delta(arrow.utcnow(), snapshot.since_time)
+            embed.add_field(name="{} Since".format(snapshot.since_status), value=since, inline=True)
+        embed.set_footer(text="Last update: {} -- See my status light for up-to-date status.".format(self.humanize_time(snapshot.update_time)))
         return embed
 
+    def embedMessage(self, status, alias):
+        return self.render_snapshot(self.snapshot_for(alias, status))
+
     @commands.group(pass_context=True, aliases=["serverlist"])
     async def _servers(self, ctx):
         servers = self.key_data.items()
@@ -223,7 +968,7 @@ class DCSServerStatus:
         message += "\n\nUse `!server <servername>` to get the status of that server"
         await self.bot.say(message)
 
-    @commands.group(pass_context=True, aliases=["server"])
+    @commands.group(pass_context=True, aliases=["server"], invoke_without_command=True)
     async def server_status(self, ctx, alias):
         """Gets the server status for the provided alias. Use !serverlist to see all the servers we're tracking"""
         if ctx.invoked_subcommand is None:
@@ -240,18 +985,137 @@ class DCSServerStatus:
                     if alias not in self.key_data:
                         await self.bot.send_message(ctx.message.author, "No server by that alias.")
                         return
-                    status = await self.get_status(self.key_data[alias]["key"])
-                    message = self.embedMessage(status, alias)
-                    await self.bot.send_message(ctx.message.author, embed=message)
+                    snapshot = self.embed_snapshots.get(alias)
+                    if snapshot is None:
+                        #Not polled yet (just added, or the first poll is still running).
+                        key = self.key_data[alias]["key"]
+                        status = await self.status_cache.get(alias, lambda: self.get_status(key))
+                        snapshot = self.embed_snapshots.get(alias) or self.snapshot_for(alias, status)
+                    await self.bot.send_message(ctx.message.author, embed=self.render_snapshot(snapshot))
                 except ErrorGettingStatus as e:
                     await self.bot.send_message(ctx.message.author, "Status unknown right now.")
                     print("Error getting status. Response code was " + str(e.status))
 
+    @server_status.command(name="history", pass_context=True)
+    async def server_history(self, ctx, alias):
+        """Shows peak, average and busiest hour for a server over the stored history"""
+        alias = alias.lower()
+        author = ctx.message.author
+        if alias not in self.key_data:
+            await self.bot.send_message(author, "No server by that alias.")
+            return
+        summary = None
+        if alias in self.histories:
+            summary = self.histories[alias].summary()
+        if summary is None:
+            await self.bot.send_message(author, "No player history recorded for {} yet.".format(alias))
+            return
+        message = (
+            "{alias} -- {samples} samples since {start}\n"
+            "Peak: {peak} players at {peak_time} on {peak_mission}\n"
+            "Average: {average:.1f} players\n"
+            "Busiest hour: {busiest_hour:02d}:00-{busiest_hour_end:02d}:00 UTC ({busiest_hour_average:.1f} players on average)\n"
+            "{sparkline}").format(
+                alias=self.key_data[alias]["alias"],
+                start=arrow.get(summary["start"]).format("YYYY-MM-DD HH:mm") + " UTC",
+                peak_time=arrow.get(summary["peak_time"]).format("YYYY-MM-DD HH:mm") + " UTC",
+                busiest_hour_end=(summary["busiest_hour"] + 1) % 24,
+                **{k: v for k, v in summary.items() if k not in ("start", "peak_time")})
+        await self.bot.send_message(author, box(message))
+
     @commands.group(pass_context=True, aliases=["serverconf"])
     async def _serverconf(self, ctx):
         if ctx.invoked_subcommand is None:
             return
 
+    @_serverconf.command()
+    @checks.mod_or_permissions(manage_server=True)
+    async def concurrency(self, limit: int):
+        """Sets how many servers are polled at the same time
+
+        This also sets the shared HTTP client's limit for the status host."""
+        if limit < 1:
+            await self.bot.say("Concurrency must be at least 1")
+            return
+        self.settings["poll_concurrency"] = limit
+        self.save_settings()
+        await self.bot.say("Polling up to {} servers at a time".format(limit))
+
+    @_serverconf.command()
+    @checks.mod_or_permissions(manage_server=True)
+    async def timeout(self, seconds: float):
+        """Sets the per-server request timeout used while polling"""
+        if seconds <= 0:
+            await self.bot.say("Timeout must be greater than 0")
+            return
+        self.settings["poll_timeout_seconds"] = seconds
+        self.save_settings()
+        await self.bot.say("Poll requests now time out after {} seconds".format(seconds))
+
+    @_serverconf.command()
+    @checks.mod_or_permissions(manage_server=True)
+    async def cachettl(self, seconds: float):
+        """Sets how long a fetched status is reused for `!server`"""
+        if seconds < 0:
+            await self.bot.say("TTL can't be negative")
+            return
+        self.settings["status_cache_ttl_seconds"] = seconds
+        self.status_cache.ttl = seconds
+        self.save_settings()
+        await self.bot.say("Statuses are now cached for {} seconds".format(seconds))
+
+    @_serverconf.command()
+    @checks.mod_or_permissions(manage_server=True)
+    async def cachestats(self):
+        """Shows how many `!server` lookups were answered without going upstream"""
+        stats = self.status_cache.stats()
+        await self.bot.say(
+            "Status cache: {hits} hits, {coalesced} coalesced, {misses} misses "
+            "({saved_ratio:.0%} served without an upstream request). {entries} servers cached.".format(**stats))
+
+    @_serverconf.command()
+    @checks.mod_or_permissions(manage_server=True)
+    async def schedule(self):
+        """Shows when each server is next polled and how many polls in a row have failed"""
+        if not self.key_data:
+            await self.bot.say("No servers are being tracked")
+            return
+        lines = []
+        for alias in sorted(self.key_data.keys()):
+            due = self.scheduler.seconds_until_due(alias)
+            due_text = "now" if due is None else "in {:.0f}s".format(due)
+            line = "{}: next poll {}, {} failures in a row".format(
+                alias, due_text, self.scheduler.failures.get(alias, 0))
+            if alias in self.status_table and self.status_table[alias]["error"]:
+                line += " (last error: {})".format(self.status_table[alias]["error"])
+            lines.append(line)
+        for page in pagify("\n".join(lines)):
+            await self.bot.say(box(page))
+
+    @_serverconf.command()
+    @checks.mod_or_permissions(manage_server=True)
+    async def rotation(self, seconds: float):
+        """Sets how long each server is shown in the bot's status"""
+        if seconds < self.presence.min_interval:
+            await self.bot.say("Rotation can't be faster than one change every {} seconds".format(self.presence.min_interval))
+            return
+        self.settings["presence_rotation_seconds"] = seconds
+        self.save_settings()
+        await self.bot.say("Rotating the displayed server every {} seconds".format(seconds))
+
+    @_serverconf.command()
+    @checks.mod_or_permissions(manage_server=True)
+    async def alerts(self, chan: discord.Channel = None):
+        """Posts server status changes to the given channel. Leave the channel out to turn alerts off"""
+        if chan is None:
+            self.settings["alert_channel"] = None
+            self.save_settings()
+            await self.bot.say("Server status alerts disabled")
+            return
+        self.settings["alert_channel"] = chan.id
+        self.save_settings()
+        await self.bot.say("Posting server status changes to {}".format(chan.name))
+
     @_serverconf.command()
     @checks.mod_or_permissions(manage_server=True)
     async def delete(self, alias):
@@ -277,6 +1141,10 @@ def check_file():
     if not dataIO.is_valid_json(f):
         print("Creating the server file to hold your api key...")
         dataIO.save_json(f, {})
+    f = "data/server_status/settings.json"
+    if not dataIO.is_valid_json(f):
+        print("Creating the server status settings file...")
+        dataIO.save_json(f, {})
 
 def setup(bot):
     check_folders()
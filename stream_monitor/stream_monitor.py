@@ -1,11 +1,11 @@
 import asyncio
-import aiohttp
 import discord
 import json
 import os
 import sys
 from .utils import checks
 from .utils.dataIO import fileIO
+from .http_client import acquire_client, release_client
 from discord.ext import commands
 
 class StreamMonitor:
@@ -15,7 +15,7 @@ class StreamMonitor:
 
     def __init__(self, bot, dataFile):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self.http = acquire_client("stream_monitor")
         self.dataFile = dataFile
         self.killSwitch = False
         self.data = fileIO(dataFile, 'load')
@@ -28,12 +28,13 @@ class StreamMonitor:
     def __unload(self):
         log("Setting killswitch to True!")
         self.killSwitch = True
+        release_client("stream_monitor")
 
 
     def makeRequest(self, data):
         url="https://api.twitch.tv/kraken/search/streams?query=DCS%20World"
         headers={'Accept': 'application/vnd.twitchtv.v5+json', 'Client-ID': data['clientId']}
-        return self.session.get(url, headers=headers)
+        return self.http.get(url, headers=headers)
 
 
     async def _poll(self):
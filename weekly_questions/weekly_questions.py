@@ -1,12 +1,22 @@
 import praw
 import asyncio
+import collections
 import discord
+import functools
 import re
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
 
+#Discord's embed limits.
+EMBED_MAX_FIELDS = 25
+EMBED_MAX_CHARS = 6000
+FIELD_NAME_MAX = 256
+FIELD_VALUE_MAX = 1024
+
 
 class RedditNotConfigured(Exception):
     def __init__(self):
@@ -15,6 +25,216 @@ class RedditNotConfigured(Exception):
         """
         return
 
+class RedditWorker:
+    """
+    Runs blocking praw calls on a dedicated thread so they never stall the event loop.
+    At most `max_pending` calls are queued at once; further callers wait for a slot.
+    """
+
+    def __init__(self, max_pending=4):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.slots = asyncio.Semaphore(max_pending)
+
+    async def run(self, func, *args):
+        async with self.slots:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+class RedditClient:
+    """
+    Keeps one authenticated praw.Reddit around instead of building one per call.
+
+    praw holds the OAuth token and renews it itself when it expires, so the client is
+    only rebuilt when the credentials change. The stickied weekly thread is looked up
+    at most once every `thread_ttl` seconds.
+    """
+
+    def __init__(self, thread_ttl=600, min_remaining=10):
+        self.thread_ttl = thread_ttl
+        self.min_remaining = min_remaining
+        self.reddit = None
+        self.credentials = None
+        self.thread = None
+        self.thread_checked = 0
+
+    def get(self, clientid, clientsecret):
+        if self.reddit is None or self.credentials != (clientid, clientsecret):
+            self.reddit = praw.Reddit(client_id=clientid, client_secret=clientsecret, user_agent='praw Hoggybot')
+            self.credentials = (clientid, clientsecret)
+            self.thread = None
+            self.thread_checked = 0
+        return self.reddit
+
+    def weekly_thread(self):
+        """
+        Blocking: returns {"id", "permalink"} for the stickied questions thread, or None.
+        """
+        if time.time() - self.thread_checked < self.thread_ttl:
+            return self.thread
+        posts = (post for post in self.reddit.subreddit('hoggit').hot(limit=2) if post.stickied)
+        self.thread = None
+        for post in posts:
+            if re.search("^Weekly Questions Thread", post.title):
+                self.thread = {"id": post.id, "permalink": post.permalink}
+                break
+        self.thread_checked = time.time()
+        return self.thread
+
+    def rate_limit_delay(self):
+        """
+        Seconds to hold off for when reddit's rate-limit headers say we're nearly out of requests.
+        """
+        if self.reddit is None:
+            return 0
+        limits = getattr(self.reddit.auth, "limits", None) or {}
+        remaining = limits.get("remaining")
+        reset = limits.get("reset_timestamp")
+        if remaining is None or reset is None or remaining >= self.min_remaining:
+            return 0
+        return max(reset - time.time(), 0)
+
+class SeenComments:
+    """
+    Ids of the comments already relayed from the current weekly thread. Only the
+    newest `capacity` ids are kept, and the set is cleared when the sticky rolls
+    over to a new thread.
+    """
+
+    def __init__(self, thread=None, ids=(), capacity=500):
+        self.thread = thread
+        self.order = collections.deque(ids, maxlen=capacity)
+        self.ids = set(self.order)
+
+    @classmethod
+    def from_json(cls, data, capacity=500):
+        return cls(data.get("thread"), data.get("ids", []), capacity)
+
+    def to_json(self):
+        return {"thread": self.thread, "ids": list(self.order)}
+
+    def use_thread(self, thread_id):
+        if thread_id != self.thread:
+            self.thread = thread_id
+            self.order.clear()
+            self.ids.clear()
+
+    def add(self, comment_id):
+        """
+        Returns True if `comment_id` hadn't been seen before.
+        """
+        if comment_id in self.ids:
+            return False
+        if len(self.order) == self.order.maxlen:
+            self.ids.discard(self.order[0])
+        self.order.append(comment_id)
+        self.ids.add(comment_id)
+        return True
+
+class SendQueue:
+    """
+    Sends queued embeds one at a time, no faster than one every `min_interval`
+    seconds. The queue is bounded, so callers wait once `max_size` messages are
+    pending. Sends that get rate limited are retried with backoff.
+    """
+
+    def __init__(self, bot, max_size=10, min_interval=1.0, max_attempts=4):
+        self.bot = bot
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.min_interval = min_interval
+        self.max_attempts = max_attempts
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def put(self, channel, embed):
+        await self.queue.put((channel, embed))
+
+    async def run(self):
+        while True:
+            channel, embed = await self.queue.get()
+            await self.send(channel, embed)
+            await asyncio.sleep(self.min_interval)
+
+    async def send(self, channel, embed):
+        for attempt in range(self.max_attempts):
+            try:
+                await self.bot.send_message(channel, embed=embed)
+                return
+            except discord.HTTPException as e:
+                if getattr(e.response, "status", None) != 429:
+                    log("Couldn't relay questions: {}".format(e))
+                    return
+                await asyncio.sleep(self.min_interval * 2 ** (attempt + 1))
+            except Exception as e:
+                log("Couldn't relay questions: {}".format(e))
+                return
+        log("Still rate limited after {} attempts, dropping a message".format(self.max_attempts))
+
+def pack_embeds(title, fields, description=None):
+    """
+    Packs (name, value) fields into as few embeds as Discord's field and character
+    limits allow. `description` goes on the first embed only.
+    """
+    embeds = []
+    embed = None
+    used = count = 0
+    for name, value in fields:
+        name = name[:FIELD_NAME_MAX]
+        value = value[:FIELD_VALUE_MAX]
+        size = len(name) + len(value)
+        if embed is None or count >= EMBED_MAX_FIELDS or used + size > EMBED_MAX_CHARS:
+            embed = discord.Embed(title=title)
+            used = len(title)
+            count = 0
+            if description and not embeds:
+                embed.description = description
+                used += len(description)
+            embeds.append(embed)
+        embed.add_field(name=name, value=value, inline=False)
+        used += size
+        count += 1
+    return embeds
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a short sleep. Samples taken
+    while a reddit poll is running are also kept separately, to show whether the
+    poll blocks the loop.
+    """
+
+    def __init__(self, interval=0.25, window=1200):
+        self.interval = interval
+        self.samples = collections.deque(maxlen=window)
+        self.poll_samples = collections.deque(maxlen=window)
+        self.polling = False
+        self.stopped = False
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while not self.stopped:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0)
+            self.samples.append(lag)
+            if self.polling:
+                self.poll_samples.append(lag)
+
+    @staticmethod
+    def summary(samples):
+        if not samples:
+            return "no samples yet"
+        ordered = sorted(samples)
+        p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+        return "p95 {:.1f}ms, max {:.1f}ms over {} samples".format(p95 * 1000, ordered[-1] * 1000, len(ordered))
+
 class HoggitWeeklyQuestions:
     """
     Relays new top-level comments from the stickied questions thread into a channel
@@ -27,40 +247,103 @@ class HoggitWeeklyQuestions:
         self.data = dataIO.load_json(data_file)
         if "ignored_usernames" not in self.data:
             self.data["ignored_usernames"] = []
+        self.ignored = set(self.data["ignored_usernames"])
         self.killPoll = False
+        self.sender = SendQueue(bot)
+        self.sender.start()
+        self.worker = RedditWorker()
+        self.client = RedditClient()
+        self.seen = SeenComments.from_json(self.data.get("reddit", {}).get("seen", {}))
+        self.lag_monitor = LoopLagMonitor()
+        asyncio.ensure_future(self.lag_monitor.run())
         asyncio.ensure_future(self.poll())
 
     def __unload(self):
         self.killPoll = True
+        self.lag_monitor.stopped = True
+        self.sender.stop()
+        self.worker.shutdown()
 
     def reddit(self):
-        if "clientid" not in self.data["reddit"] or "clientsecret" not in self.data["reddit"]:
+        config = self.data.get("reddit", {})
+        if "clientid" not in config or "clientsecret" not in config:
             raise RedditNotConfigured()
-        clientid = self.data["reddit"]["clientid"]
-        clientsecret = self.data["reddit"]["clientsecret"]
-        return praw.Reddit(client_id=clientid, client_secret=clientsecret, user_agent='praw Hoggybot')
+        return self.client.get(config["clientid"], config["clientsecret"])
 
     def save_data(self, data):
         dataIO.save_json(self.data_file, data)
 
 
     def weekly_thread(self):
-        subreddit = self.reddit().subreddit('hoggit')
-        posts = (post for post in subreddit.hot(limit=2) if post.stickied)
-        for post in posts:
-            if re.search("^Weekly Questions Thread", post.title):
-                return post
+        self.reddit()
+        return self.client.weekly_thread()
+
+    def weekly_thread_link(self):
+        thread = self.weekly_thread()
+        if thread:
+            return "http://reddit.com{}".format(thread["permalink"])
         return None
 
+    @staticmethod
+    def comment_data(comment):
+        """
+        Copies what we need out of a praw comment, so nothing lazy-loads later on the event loop.
+        """
+        return {
+            "id": comment.id,
+            "author": comment.author.name if comment.author else "[deleted]",
+            "body": comment.body,
+            "permalink": comment.permalink,
+            "created_utc": comment.created_utc
+        }
+
+    def fetch_new_comments(self, last_utc_check):
+        """
+        Blocking: fetches the newest top-level comments, stopping at the first one older
+        than `last_utc_check`. Returns (thread id, comments, truncated), where truncated
+        means the comment limit was hit before reaching an old comment, so some new ones
+        weren't fetched. Runs on the reddit worker.
+        """
+        thread = self.weekly_thread()
+        if thread is None:
+            return None, [], False
+        #A fresh Submission each poll: praw only loads a submission's comments once.
+        submission = self.reddit().submission(id=thread["id"])
+        submission.comment_sort = 'new'
+        submission.comment_limit = self.data.get("comment_limit", 100)
+        comments = []
+        more = False
+        for comment in submission.comments:
+            if isinstance(comment, praw.models.MoreComments):
+                more = True
+                continue
+            if comment.created_utc < last_utc_check:
+                #Stickied comments are listed first whatever their age.
+                if comment.stickied:
+                    continue
+                return thread["id"], comments, False
+            comments.append(self.comment_data(comment))
+        return thread["id"], comments, more
+
     async def weekly_questions_comments(self, last_utc_check):
+        """
+        Returns (comments, truncated): the comments that haven't been relayed yet, oldest
+        first, and whether older new ones were cut off by the comment limit. Comments sharing
+        `last_utc_check`'s timestamp are fetched again and dropped by id, so none are lost.
+        """
         if not last_utc_check:
             last_utc_check = 0
-        thread = self.weekly_thread()
-        thread.comment_sort = 'new'
-        comments = [c for c in thread.comments if c.created_utc > last_utc_check]
-        return comments
+        thread_id, comments, truncated = await self.worker.run(self.fetch_new_comments, last_utc_check)
+        if thread_id is None:
+            return [], False
+        if truncated and last_utc_check:
+            log("Hit the comment limit of {}; some older new questions weren't fetched".format(
+                self.data.get("comment_limit", 100)))
+        self.seen.use_thread(thread_id)
+        comments.sort(key=lambda c: c["created_utc"])
+        return [c for c in comments if self.seen.add(c["id"])], truncated and bool(last_utc_check)
 
-    async def say_comments(self, comments):
+    async def say_comments(self, comments, truncated=False):
         if "channel" not in self.data:
             log("Could not post {} comments to a channel, as no channel is configured".format(len(comments)))
             return
@@ -69,34 +352,57 @@ class HoggitWeeklyQuestions:
         if not chan:
             log("Can't find channel with id: {}".format(channel_id))
             return
+        comments = [c for c in comments if c["author"] not in self.ignored]
+        max_batch = self.data.get("max_batch", 20)
+        description = None
+        skipped = max(len(comments) - max_batch, 0)
+        link = self.cached_thread_link() or "the weekly thread"
+        if truncated and skipped:
+            description = "{} more new questions, plus older ones past the fetch limit, in {}".format(skipped, link)
+        elif truncated:
+            description = "Older new questions past the fetch limit are in {}".format(link)
+        elif skipped:
+            description = "{} more new questions in {}".format(skipped, link)
+        comments = comments[skipped:]
+        fields = []
         for comment in comments:
-            if comment.author.name not in self.data["ignored_usernames"]:
-                embed = discord.Embed()
-                question = comment.body[:250] + "..." if len(comment.body) > 250 else comment.body
-                embed.add_field(name="User", value=comment.author.name, inline=False)
-                embed.add_field(name="Question", value=question, inline=False)
-                embed.add_field(name="Link", value="https://reddit.com{}".format(comment.permalink), inline=False)
-                await self.bot.send_message(chan, embed=embed)
+            question = comment["body"][:250] + "..." if len(comment["body"]) > 250 else comment["body"]
+            fields.append((comment["author"], "{}\nhttps://reddit.com{}".format(question, comment["permalink"])))
+        for embed in pack_embeds("New weekly questions", fields, description):
+            await self.sender.put(chan, embed)
+
+    def cached_thread_link(self):
+        """
+        The weekly thread link from the last lookup, without asking reddit again.
+        """
+        if self.client.thread:
+            return "https://reddit.com{}".format(self.client.thread["permalink"])
+        return None
 
     async def poll(self):
         try:
             await self.bot.wait_until_ready()
-            last_utc = 0
-            if "last_utc_check" in self.data["reddit"]:
-                last_utc = self.data["reddit"]["last_utc_check"]
-            comments = await self.weekly_questions_comments(last_utc)
+            last_utc = self.data.get("reddit", {}).get("last_utc_check", 0)
+            self.lag_monitor.polling = True
+            try:
+                comments, truncated = await self.weekly_questions_comments(last_utc)
+            finally:
+                self.lag_monitor.polling = False
             if len(comments) > 0:
-                last_comment_utc = max(c.created_utc for c in comments)
+                last_comment_utc = max(c["created_utc"] for c in comments)
                 self.data["reddit"]["last_utc_check"] = last_comment_utc
+                self.data["reddit"]["seen"] = self.seen.to_json()
                 self.save_data(self.data)
-                await self.say_comments(comments)
+                await self.say_comments(comments, truncated)
         except RedditNotConfigured:
             log("Reddit not configured. Skipping poll")
+        except Exception as e:
+            log("Unexpected error polling reddit: {}".format(e))
         finally:
             if self.killPoll:
                 log("Killswitch engaged. Stopping polling")
                 return
-            await asyncio.sleep(10)
+            await asyncio.sleep(max(10, self.client.rate_limit_delay()))
             asyncio.ensure_future(self.poll())
 
     @commands.group(name="weeklyquestions", pass_context=True, invoke_without_command=True)
@@ -104,9 +410,9 @@ class HoggitWeeklyQuestions:
         """
         Lists the current weekly questions thread
         """
-        post = self.weekly_thread()
-        if post:
-            await self.bot.say("This week's question thread: http://reddit.com{}".format(post.permalink))
+        link = await self.worker.run(self.weekly_thread_link)
+        if link:
+            await self.bot.say("This week's question thread: {}".format(link))
             return
 
         await self.bot.say("Couldn't find this week's question thread. Is it stickied?")
@@ -119,12 +425,50 @@ class HoggitWeeklyQuestions:
         Ignores a username from the weekly threads.
         Commands by these users are no longer displayed
         """
-        if "ignored_usernames" not in self.data:
-            self.data["ignored_usernames"] = []
-        self.data["ignored_usernames"].append(user)
-        self.save_data(self.data)
+        if user not in self.ignored:
+            self.ignored.add(user)
+            self.data["ignored_usernames"].append(user)
+            self.save_data(self.data)
         await self.bot.say("Added {} to ignored list".format(user))
 
+    @_weeklyquestions.command(name="maxbatch")
+    @checks.is_owner()
+    async def _max_batch(self, count: int):
+        """
+        Sets how many questions are relayed at once after downtime or a burst.
+        Anything past that is summed up with a link to the thread.
+        """
+        if count < 1:
+            await self.bot.say("The batch needs to be at least 1 question")
+            return
+        self.data["max_batch"] = count
+        self.save_data(self.data)
+        await self.bot.say("Relaying up to {} questions at once".format(count))
+
+    @_weeklyquestions.command(name="commentlimit")
+    @checks.is_owner()
+    async def _comment_limit(self, count: int):
+        """
+        Sets how many of the newest comments are fetched per poll.
+        Raise it if the thread gets busier than that between polls.
+        """
+        if count < 1:
+            await self.bot.say("The limit needs to be at least 1 comment")
+            return
+        self.data["comment_limit"] = count
+        self.save_data(self.data)
+        await self.bot.say("Fetching up to {} comments per poll".format(count))
+
+    @_weeklyquestions.command(name="lag")
+    @checks.is_owner()
+    async def _lag(self):
+        """
+        Shows how much the event loop has lagged, overall and while polling reddit
+        """
+        await self.bot.say("Event loop lag: {}\nWhile polling reddit: {}".format(
+            LoopLagMonitor.summary(self.lag_monitor.samples),
+            LoopLagMonitor.summary(self.lag_monitor.poll_samples)))
+
     @_weeklyquestions.command(name="channel")
     @checks.is_owner()
     async def _set_channel(self, chan: discord.Channel):
@@ -1,16 +1,469 @@
 import asyncio
 import os
-import aiohttp
 import discord
 import arrow
 import json
 import sys
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from .utils.chat_formatting import pagify
 from .utils import checks
 from .utils.dataIO import fileIO, dataIO
+from .http_client import acquire_client, release_client
 from discord.ext import commands
-from urllib.parse import urlencode
+import re
+import io
+import time
+import collections
+from urllib.parse import urlencode, quote, unquote
+
+
+def tokenize(text):
+    """
+    Lowercases `text` and splits it on anything that isn't a letter or digit.
+    "F/A-18C Hornet" -> ["f", "a", "18c", "hornet"]
+    """
+    return [token for token in re.split(r"[^0-9a-z]+", text.lower()) if token]
+
+
+class Trie:
+    """
+    Character trie mapping string keys to sets of values, with prefix lookups.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, value):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(None, set()).add(value)
+
+    def remove(self, key, value):
+        path = [self.root]
+        for char in key:
+            if char not in path[-1]:
+                return
+            path.append(path[-1][char])
+        values = path[-1].get(None, set())
+        values.discard(value)
+        if not values:
+            path[-1].pop(None, None)
+        #Prune nodes that no longer lead anywhere.
+        for depth in range(len(key), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][key[depth - 1]]
+
+    def get(self, key):
+        node = self.root
+        for char in key:
+            if char not in node:
+                return set()
+            node = node[char]
+        return node.get(None, set())
+
+    def with_prefix(self, prefix, limit=200):
+        node = self.root
+        for char in prefix:
+            if char not in node:
+                return set()
+            node = node[char]
+        found = set()
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    found.update(child)
+                else:
+                    stack.append(child)
+        return found
+
+    @staticmethod
+    def edit_cost(char):
+        #Getting a number wrong (F-16 vs F-18) matters more than a missing letter.
+        return 2 if char.isdigit() else 1
+
+
+def weighted_distance(a, b):
+    """
+    Edit distance between `a` and `b`, weighted by Trie.edit_cost.
+    """
+    cost = Trie.edit_cost
+    previous_row = [0]
+    for char in a:
+        previous_row.append(previous_row[-1] + cost(char))
+    for char in b:
+        row = [previous_row[0] + cost(char)]
+        for column in range(1, len(a) + 1):
+            substitution = 0 if a[column - 1] == char else max(cost(a[column - 1]), cost(char))
+            row.append(min(
+                row[column - 1] + cost(a[column - 1]),
+                previous_row[column] + cost(char),
+                previous_row[column - 1] + substitution))
+        previous_row = row
+    return previous_row[-1]
+
+
+class DeletionIndex:
+    """
+    Symmetric-delete index for edit-distance lookups. Every key is stored under
+    each string left after deleting up to `max_deletes` of its characters, so a
+    lookup only generates the query's own deletions instead of walking every key.
+    """
+
+    def __init__(self, max_deletes=2):
+        self.max_deletes = max_deletes
+        self.variants = {}
+
+    @staticmethod
+    def deletions(key, depth):
+        found = {key}
+        frontier = {key}
+        for _ in range(depth):
+            frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+            found |= frontier
+        return found
+
+    def add(self, key):
+        for variant in self.deletions(key, self.max_deletes):
+            self.variants.setdefault(variant, set()).add(key)
+
+    def remove(self, key):
+        for variant in self.deletions(key, self.max_deletes):
+            keys = self.variants.get(variant)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.variants[variant]
+
+    def search(self, query, max_distance):
+        """
+        Returns {key: distance} for every key within `max_distance` weighted edits of `query`.
+        """
+        candidates = set()
+        for variant in self.deletions(query, min(max_distance, self.max_deletes)):
+            candidates.update(self.variants.get(variant, ()))
+        found = {}
+        for key in candidates:
+            distance = weighted_distance(query, key)
+            if distance <= max_distance:
+                found[key] = distance
+        return found
+
+
+class TitleIndex:
+    """
+    In-memory index of wiki page titles.
+
+    Titles are indexed by token (an inverted index, with a trie over the tokens
+    for prefix lookups and a symmetric-delete index for typos) and by their
+    "compact" form with all punctuation removed, so "fa18c", "F/A 18C" and
+    "f/a-18" all find "F/A-18C".
+    """
+
+    def __init__(self):
+        self.titles = {}
+        self.postings = {}
+        self.token_trie = Trie()
+        self.token_deletions = DeletionIndex()
+        self.compact_trie = Trie()
+        self.ready = False
+
+    @staticmethod
+    def compact(text):
+        return "".join(tokenize(text))
+
+    def add(self, title):
+        if title in self.titles:
+            return
+        tokens = tokenize(title)
+        self.titles[title] = "".join(tokens)
+        for token in set(tokens):
+            if token not in self.postings:
+                self.postings[token] = set()
+                self.token_trie.insert(token, token)
+                self.token_deletions.add(token)
+            self.postings[token].add(title)
+        self.compact_trie.insert(self.titles[title], title)
+
+    def remove(self, title):
+        if title not in self.titles:
+            return
+        compact = self.titles.pop(title)
+        self.compact_trie.remove(compact, title)
+        for token in set(tokenize(title)):
+            self.postings[token].discard(title)
+            if not self.postings[token]:
+                del self.postings[token]
+                self.token_trie.remove(token, token)
+                self.token_deletions.remove(token)
+
+    def replace(self, titles):
+        self.__init__()
+        for title in titles:
+            self.add(title)
+        self.ready = True
+
+    def rank(self, titles, query):
+        return sorted(titles, key=lambda t: (t.lower() != query.lower(), len(self.titles[t]), t))
+
+    def token_matches(self, tokens):
+        """
+        Titles containing every token, treating the last one as a prefix.
+        """
+        matches = None
+        for token in tokens[:-1]:
+            titles = self.postings.get(token, set())
+            matches = set(titles) if matches is None else matches & titles
+        last = set()
+        for token in self.token_trie.with_prefix(tokens[-1]):
+            last.update(self.postings[token])
+        return last if matches is None else matches & last
+
+    def lookup(self, query, limit=3):
+        """
+        Returns ("exact", [title]) for a confident single match, ("suggestions", titles)
+        when several titles match the query's words or one title is clearly the closest
+        misspelling, or (None, []) when the index can't answer and the caller should
+        search the wiki instead.
+        """
+        tokens = tokenize(query)
+        if not self.ready or not tokens:
+            return None, []
+        compact = "".join(tokens)
+        exact = self.compact_trie.get(compact)
+        if exact:
+            return "exact", self.rank(exact, query)[:1]
+        matches = self.token_matches(tokens)
+        if len(matches) == 1:
+            return "exact", list(matches)
+        if matches:
+            return "suggestions", self.rank(matches, query)[:limit]
+        fuzzy = self.fuzzy_token_matches(tokens)
+        if fuzzy:
+            #A typo is only worth suggesting when one title is clearly closer than the rest.
+            scored = sorted((distance, title) for title, distance in fuzzy.items())
+            if len(scored) == 1 or scored[1][0] - scored[0][0] >= self.fuzzy_margin:
+                return "suggestions", [scored[0][1]]
+        return None, []
+
+    #How much closer the best fuzzy match must be than the runner-up.
+    fuzzy_margin = 1
+
+    @staticmethod
+    def max_distance(text):
+        return 1 if len(text) <= 6 else 2 if len(text) <= 10 else 3
+
+    def fuzzy_token_matches(self, tokens):
+        """
+        Returns {title: distance} for titles that have a close match for every token,
+        where distance is the sum of each token's distance. Tokens are compared whole.
+        """
+        matches = None
+        for token in tokens:
+            distances = {}
+            for match, distance in self.token_deletions.search(token, self.max_distance(token)).items():
+                for title in self.postings[match]:
+                    distances[title] = min(distances.get(title, distance), distance)
+            if matches is None:
+                matches = distances
+            else:
+                matches = {title: matches[title] + distance for title, distance in distances.items() if title in matches}
+        return matches
+
+
+class SynonymEngine:
+    """
+    Resolves `!wiki` queries through the configured synonyms.
+
+    Aliases are matched on their compact form (lowercase, no whitespace or
+    punctuation), so "F-18", "f18" and "F 18" are the same alias. Queries that don't
+    match exactly fall back to edit distance (through a symmetric-delete index) and
+    then to unambiguous prefixes (through a trie). Both are updated in place as
+    synonyms are added or removed, and changes are written to disk in the background.
+    """
+
+    def __init__(self, file_path, synonyms, save_delay=2):
+        self.file_path = file_path
+        self.synonyms = synonyms
+        self.save_delay = save_delay
+        self.pending_save = None
+        self.trie = Trie()
+        self.deletions = DeletionIndex()
+        for alias in synonyms:
+            self.index(alias)
+
+    def index(self, alias):
+        compact = TitleIndex.compact(alias)
+        if not self.trie.get(compact):
+            self.deletions.add(compact)
+        self.trie.insert(compact, alias)
+
+    def unindex(self, alias):
+        compact = TitleIndex.compact(alias)
+        self.trie.remove(compact, alias)
+        if not self.trie.get(compact):
+            self.deletions.remove(compact)
+
+    @staticmethod
+    def max_distance(compact):
+        #Short aliases are too easy to hit by accident, only match them exactly.
+        return 0 if len(compact) <= 3 else 1 if len(compact) <= 6 else 2
+
+    def add(self, alias, target):
+        alias = alias.strip().lower()
+        if alias in self.synonyms:
+            self.unindex(alias)
+        self.synonyms[alias] = target
+        self.index(alias)
+        self.schedule_save()
+        return alias
+
+    def remove(self, alias):
+        alias = alias.strip().lower()
+        if alias not in self.synonyms:
+            return None
+        self.unindex(alias)
+        self.schedule_save()
+        return self.synonyms.pop(alias)
+
+    def import_synonyms(self, synonyms):
+        for alias, target in synonyms.items():
+            self.add(alias, target)
+        return len(synonyms)
+
+    def export_synonyms(self):
+        return dict(self.synonyms)
+
+    def pick(self, aliases, query):
+        if query.lower() in aliases:
+            return self.synonyms[query.lower()]
+        return self.synonyms[sorted(aliases)[0]]
+
+    def resolve(self, query):
+        """
+        Returns the synonym target for `query`, or None if no alias matches closely enough.
+        """
+        compact = TitleIndex.compact(query)
+        if not compact:
+            return None
+        exact = self.trie.get(compact)
+        if exact:
+            return self.pick(exact, query)
+        fuzzy = self.deletions.search(compact, self.max_distance(compact))
+        #The shorter of query and alias sets the allowance, so "hogg" can't reach "hog".
+        fuzzy = {key: distance for key, distance in fuzzy.items()
+                 if distance <= self.max_distance(min(compact, key, key=len))}
+        if fuzzy:
+            best = min(fuzzy.values())
+            closest = [alias for key, distance in fuzzy.items() if distance == best for alias in self.trie.get(key)]
+            if len(set(self.synonyms[alias] for alias in closest)) == 1:
+                return self.synonyms[closest[0]]
+        if len(compact) >= 3:
+            completions = self.trie.with_prefix(compact)
+            if completions and len(set(self.synonyms[alias] for alias in completions)) == 1:
+                return self.pick(completions, query)
+        return None
+
+    def schedule_save(self):
+        if self.pending_save is None:
+            self.pending_save = asyncio.ensure_future(self.delayed_save())
+
+    async def delayed_save(self):
+        await asyncio.sleep(self.save_delay)
+        self.pending_save = None
+        snapshot = dict(self.synonyms)
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, dataIO.save_json, self.file_path, snapshot)
+        except Exception as e:
+            print("Wiki: Failed to save synonyms: {}".format(e))
+
+    def flush(self):
+        if self.pending_save is None:
+            return
+        self.pending_save.cancel()
+        self.pending_save = None
+        dataIO.save_json(self.file_path, self.synonyms)
+
+
+class SearchCache:
+    """
+    Bounded LRU cache of `!wiki` search answers, each kept for at most `ttl` seconds.
+
+    An answer is either {"redirect": url} or {"results": [...]}. Entries are also
+    indexed by the page titles they point at, so an edit to a page can drop every
+    answer that mentions it.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.by_title = {}
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, query):
+        if query not in self.entries:
+            self.misses += 1
+            return None
+        stored_at, answer, titles = self.entries[query]
+        if time.monotonic() - stored_at > self.ttl:
+            self.discard(query)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(query)
+        self.hits += 1
+        return answer
+
+    def put(self, query, answer, titles):
+        self.discard(query)
+        self.entries[query] = (time.monotonic(), answer, titles)
+        for title in titles:
+            self.by_title.setdefault(title, set()).add(query)
+        while len(self.entries) > self.max_entries:
+            self.discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def discard(self, query):
+        if query not in self.entries:
+            return
+        _, _, titles = self.entries.pop(query)
+        for title in titles:
+            queries = self.by_title.get(title)
+            if queries is not None:
+                queries.discard(query)
+                if not queries:
+                    del self.by_title[title]
+
+    def invalidate(self, title):
+        for query in list(self.by_title.get(title, ())):
+            self.discard(query)
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.by_title.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
 
 
 class HoggitWiki:
@@ -20,68 +473,222 @@ class HoggitWiki:
 
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self.http = acquire_client("wiki")
         self.killSwitch = False
-        self.synonyms = fileIO('data/wiki/synonyms.json', 'load')
+        self.synonyms = SynonymEngine('data/wiki/synonyms.json', fileIO('data/wiki/synonyms.json', 'load'))
         self.base_url = "https://wiki.hoggitworld.com"
-        self.recent_changes_url = self.base_url + "/api.php?action=query&list=recentchanges&rcprop=user|title|timestamp&format=json&rctype=edit"
-        self.last_wiki_check = arrow.utcnow()
+        self.api_url = self.base_url + "/api.php"
         self.alerts = fileIO('data/wiki/alerts.json', 'load')
+        self.alert_task = None
+        self.alert_generation = 0
+        self.title_index = TitleIndex()
+        self.search_cache = SearchCache()
+        self.index_built = None
+        self.index_cursor = None
+        self.index_refresh_seconds = 600
+        self.index_rebuild_seconds = 24 * 3600
         asyncio.ensure_future(self.start_alerts())
+        asyncio.ensure_future(self.build_title_index())
 
 
     def __unload(self):
         #Needed to not reschedule the next check.
-        self.killswitch = True
+        self.killSwitch = True
+        self.synonyms.flush()
+        release_client("wiki")
 
     async def start_alerts(self):
         await self.bot.wait_until_ready()
+        if self.alert_task is not None:
+            self.alert_task.cancel()
+            self.alert_task = None
+        #Bumped even when alerts are switched off, so any old loop still running stops.
+        self.alert_generation += 1
         if "channel" not in self.alerts:
             print("Wiki: No alerts to start")
         else:
             channel = self.alerts["channel"]
-            print("Wiki: Starting alerting to channel: " + self.bot.get_channel(channel).name)
-            asyncio.ensure_future(self._alert(channel))
-
-    def format_recent_changes(self, results):
-        embed=discord.Embed(title="Wiki changes since {}".format(self.last_wiki_check.humanize()))
-        results_length = len(results)
-        trimmed_results = results[:5]
-        for result in trimmed_results:
-            url = self.base_url + "/view/" + urlencode(result["title"])
-            print("Wiki: Setting url for field: " + url)
+            print("Wiki: Starting alerting to channel: {}".format(channel))
+            if "cursor" not in self.alerts:
+                self.alerts["cursor"] = self.new_cursor()
+            self.alert_task = asyncio.ensure_future(self._alert(channel, self.alert_generation))
+
+    @staticmethod
+    def new_cursor():
+        return {"timestamp": arrow.utcnow().format('YYYY-MM-DDTHH:mm:ss') + "Z", "rcid": 0}
+
+    async def recent_changes(self, cursor, rctype):
+        """
+        Fetches every recent change after `cursor`, oldest first, following rccontinue
+        across pages. `cursor` is {"timestamp", "rcid"}; changes at or below its rcid
+        have already been seen and are skipped. Returns the changes and the cursor to
+        resume from.
+        """
+        pages = await self.api_query({
+            "list": "recentchanges",
+            "rctype": rctype,
+            "rcprop": "user|title|timestamp|ids|loginfo",
+            "rcdir": "newer",
+            "rcstart": cursor["timestamp"],
+            "rclimit": "500"})
+        changes = []
+        seen = set()
+        for page in pages:
+            for change in page.get("recentchanges", []):
+                if change["rcid"] <= cursor["rcid"] or change["rcid"] in seen:
+                    continue
+                seen.add(change["rcid"])
+                changes.append(change)
+        if not changes:
+            return changes, cursor
+        return changes, {"timestamp": changes[-1]["timestamp"], "rcid": max(seen)}
+
+    @staticmethod
+    def collapse_changes(changes):
+        """
+        Merges every change to the same page into one entry, most recently changed first.
+        """
+        pages = collections.OrderedDict()
+        for change in changes:
+            title = change["title"]
+            if title not in pages:
+                pages[title] = {"title": title, "users": [], "edits": 0, "new": False}
+            page = pages[title]
+            page["edits"] += 1
+            page["timestamp"] = change["timestamp"]
+            page["new"] = page["new"] or change.get("type") == "new"
+            if change.get("user") and change["user"] not in page["users"]:
+                page["users"].append(change["user"])
+        return sorted(pages.values(), key=lambda p: p["timestamp"], reverse=True)
+
+    def format_recent_changes(self, pages, since):
+        embed=discord.Embed(title="Wiki changes since {}".format(arrow.get(since).humanize()))
+        for page in pages[:5]:
+            edits = "new page" if page["new"] else "1 edit" if page["edits"] == 1 else "{} edits".format(page["edits"])
             embed.add_field(
-                    name=result["title"],
-                    value="{} - {}".format(result["user"], arrow.get(result["timestamp"]).humanize()),
-                    url=url)
+                    name=page["title"],
+                    value="{} - {}, {} - [view]({})".format(
+                        ", ".join(page["users"]), edits,
+                        arrow.get(page["timestamp"]).humanize(), self.page_url(page["title"])),
+                    inline=False)
 
-        if results_length > 5:
-            embed.set_footer(text="And {} more changes omitted".format(results.length - 5))
+        if len(pages) > 5:
+            embed.set_footer(text="And {} more pages changed".format(len(pages) - 5))
         return embed
 
 
-    async def _alert(self, chan_id):
-        await asyncio.sleep(3600) #1 hour
+    async def _alert(self, chan_id, generation):
+        await asyncio.sleep(self.alerts.get("interval_minutes", 60) * 60)
         if self.killSwitch:
             return
-        timestamp = self.last_wiki_check.format('YYYY-MM-DDTHH:mm:ss')
-        url = self.recent_changes_url + "&rcend=" + timestamp
         try:
-            response = await self.session.get(url)
-            recent_changes = json.loads(await response.text())
-            results = recent_changes["query"]["recentchanges"]
-            if not results:
+            cursor = self.alerts["cursor"]
+            changes, next_cursor = await self.recent_changes(cursor, "edit|new")
+            if not changes:
                 print("Wiki-Alerts: Checked wiki but no updates. Continuing...")
             else:
-                formatted_results = self.format_recent_changes(results)
-                self.last_wiki_check = arrow.utcnow()
                 channel = self.bot.get_channel(chan_id)
-                await self.bot.send_message(channel, embed=formatted_results)
+                embed = self.format_recent_changes(self.collapse_changes(changes), cursor["timestamp"])
+                await self.bot.send_message(channel, embed=embed)
+                #Only move the cursor once the changes are posted, so a failed send is retried.
+                self.alerts["cursor"] = next_cursor
+                dataIO.save_json('data/wiki/alerts.json', self.alerts)
+        except asyncio.CancelledError:
+            #Cancelled by start_alerts, which has already started the loop replacing this one.
+            raise
+        except Exception as e:
+            print("Wiki: Unexpected error sending wiki recent changes: {}".format(e))
+        #A newer alert loop replaces this one whenever the channel or interval changes.
+        if generation == self.alert_generation and not self.killSwitch:
+            self.alert_task = asyncio.ensure_future(self._alert(chan_id, generation))
+
+    async def api_query(self, params):
+        """
+        Runs an api.php query, following continuation, and returns the `query`
+        object from every page of results.
+        """
+        pages = []
+        params = dict(params, action="query", format="json")
+        while True:
+            response = await self.http.get(self.api_url + "?" + urlencode(params))
+            if response.status != 200:
+                raise Exception("Wiki API returned {}".format(response.status))
+            data = json.loads(await response.text())
+            pages.append(data.get("query", {}))
+            if "continue" in data:
+                params.update(data["continue"])
+            elif "query-continue" in data:
+                for values in data["query-continue"].values():
+                    params.update(values)
+            else:
+                return pages
+
+    async def fetch_all_titles(self):
+        titles = []
+        for page in await self.api_query({"list": "allpages", "aplimit": "500"}):
+            titles.extend(p["title"] for p in page.get("allpages", []))
+        return titles
+
+    async def build_title_index(self):
+        """
+        Builds the title index from the allpages API, then keeps it up to date.
+        """
+        try:
+            titles = await self.fetch_all_titles()
+            self.title_index.replace(titles)
+            self.index_built = arrow.utcnow()
+            self.index_cursor = self.new_cursor()
+            print("Wiki: Indexed {} page titles".format(len(titles)))
+        except Exception as e:
+            print("Wiki: Failed to build the title index: {}".format(e))
+        finally:
+            if not self.killSwitch:
+                asyncio.ensure_future(self.refresh_title_index())
+
+    def apply_title_changes(self, changes):
+        for change in changes:
+            self.search_cache.invalidate(change["title"])
+            if change.get("type") == "new":
+                self.title_index.add(change["title"])
+            elif change.get("logtype") == "delete" and change.get("logaction") == "delete":
+                self.title_index.remove(change["title"])
+            elif change.get("logtype") == "move":
+                params = change.get("logparams", {})
+                target = params.get("target_title") or change.get("move", {}).get("new_title")
+                self.title_index.remove(change["title"])
+                if target:
+                    self.title_index.add(target)
+                    self.search_cache.invalidate(target)
+
+    async def refresh_title_index(self):
+        """
+        Applies page creations, deletions and moves from recentchanges to the title
+        index, drops cached searches pointing at changed pages, and rebuilds the
+        index from scratch once a day.
+        """
+        await asyncio.sleep(self.index_refresh_seconds)
+        if self.killSwitch:
+            return
+        if not self.title_index.ready or arrow.utcnow() > self.index_built.shift(seconds=self.index_rebuild_seconds):
+            asyncio.ensure_future(self.build_title_index())
+            return
+        try:
+            changes, self.index_cursor = await self.recent_changes(self.index_cursor, "edit|new|log")
+            self.apply_title_changes(changes)
         except Exception as e:
-            print("Wiki: Unexpected error sending wiki recent changes: " + e)
+            print("Wiki: Failed to refresh the title index: {}".format(e))
         finally:
-            if self.alerts["channel"] == chan_id and not self.killSwitch:
-                asyncio.ensure_future(self._alert(chan_id))
+            if not self.killSwitch:
+                asyncio.ensure_future(self.refresh_title_index())
+
+    def page_url(self, title):
+        return self.base_url + "/view/" + quote(title.replace(" ", "_"), safe="/:")
+
+    @staticmethod
+    def title_from_url(url):
+        if "/view/" not in url:
+            return None
+        return unquote(url.split("/view/", 1)[1]).replace("_", " ")
 
     def url(self, search):
         return self.base_url + "/index.php?title=Special%3ASearch&search={}&go=Go".format(search)
@@ -95,12 +702,13 @@ class HoggitWiki:
         await self.bot.say(message)
 
     async def parse_results(self, response):
-        soup = BeautifulSoup(await response.text())
+        #Only build a tree for the result headings, not the whole page.
+        headings = SoupStrainer("div", class_="mw-search-result-heading")
+        soup = BeautifulSoup(await response.text(), "html.parser", parse_only=headings)
         search_results = soup.find_all("div", "mw-search-result-heading")
-        results_parsed = 0
         max_results = 3
         parsed_results = []
-        links_used = []
+        links_used = set()
         for ele in search_results:
             sr = ele.find("a")
             result = dict()
@@ -108,13 +716,53 @@ class HoggitWiki:
             result["link"] = self.base_url + sr["href"]
             if result["link"] not in links_used:
                 parsed_results.append(result)
-                links_used.append(result["link"])
-                results_parsed += 1
-                if results_parsed >= max_results:
+                links_used.add(result["link"])
+                if len(parsed_results) >= max_results:
                     break
 
         return parsed_results
 
+    def api_search_url(self, query):
+        return self.api_url + "?" + urlencode({
+            "action": "query",
+            "format": "json",
+            "titles": query,
+            "redirects": "1",
+            "list": "search",
+            "srsearch": query,
+            "srlimit": "3",
+            "srprop": ""})
+
+    def parse_api_search(self, data):
+        """
+        Turns an api_search_url response into a search answer and the titles it points at.
+        A page that exists under the query's title (after redirects) is a direct hit,
+        same as Special:Search's "Go".
+        """
+        query = data["query"]
+        for page in query.get("pages", {}).values():
+            if "missing" not in page and "invalid" not in page:
+                return {"redirect": self.page_url(page["title"])}, [page["title"]]
+        titles = []
+        for result in query.get("search", []):
+            if result["title"] not in titles:
+                titles.append(result["title"])
+        titles = titles[:3]
+        return {"results": [{"title": t, "link": self.page_url(t)} for t in titles]}, titles
+
+    async def api_search(self, query):
+        resp = await self.http.get(self.api_search_url(query))
+        if resp.status != 200:
+            raise Exception("Wiki API returned {}".format(resp.status))
+        return self.parse_api_search(json.loads(await resp.text()))
+
+    async def html_search(self, query):
+        resp = await self.http.get(self.url(query))
+        if HoggitWiki.was_redirect(resp):
+            return {"redirect": resp.url}, [self.title_from_url(resp.url)]
+        results = await self.parse_results(resp)
+        return {"results": results}, [result["title"] for result in results]
+
     @staticmethod
     def format_results(results):
         formatted_results = []
@@ -123,8 +771,24 @@ class HoggitWiki:
             formatted_results.append(formatted)
         return formatted_results
 
-    async def bot_say_search_results(self, response):
-        results = await self.parse_results(response)
+    async def search(self, query):
+        """
+        Searches the wiki, returning a cached answer if there is one. Uses the JSON
+        search API, and only scrapes Special:Search if the API fails.
+        """
+        key = " ".join(query.lower().split())
+        answer = self.search_cache.get(key)
+        if answer is not None:
+            return answer
+        try:
+            answer, titles = await self.api_search(query)
+        except Exception as e:
+            print("Wiki: API search failed, falling back to Special:Search: {}".format(e))
+            answer, titles = await self.html_search(query)
+        self.search_cache.put(key, answer, [title for title in titles if title])
+        return answer
+
+    async def bot_say_results(self, results):
         formatted_results = HoggitWiki.format_results(results)
         if len(formatted_results) == 0:
             message = "Could not find any results :("
@@ -133,42 +797,101 @@ class HoggitWiki:
                     "\n".join(str(x) for x in formatted_results))
         await self.bot.say(message)
 
-    @commands.command()
+    @staticmethod
+    def parse_synonym_list(text):
+        """
+        Reads synonyms either as a JSON object of alias -> target, or as lines of `alias > target`.
+        """
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict):
+                return {str(k): str(v) for k, v in data.items()}
+        except ValueError:
+            pass
+        synonyms = {}
+        for line in text.splitlines():
+            if '>' in line:
+                alias, target = line.split('>', 1)
+                if alias.strip() and target.strip():
+                    synonyms[alias.strip()] = target.strip()
+        return synonyms
+
+    @commands.command(pass_context=True)
     @checks.mod_or_permissions(manage_server=True)
-    async def wiki_syn(self, command, *args):
+    async def wiki_syn(self, ctx, command, *args):
+        """
+        Manages !wiki synonyms.
+
+        add <alias> > <target>, remove <alias>, import (attach a JSON object or `alias > target` lines), export
+        """
         query = ' '.join(args)
         if command == "add":
             syn = query.split('>')[0].strip().lower()
             target = query.split('>')[1].strip()
-            self.synonyms[syn] = target
-
-            fileIO('data/wiki/synonyms.json', 'save', self.synonyms)
+            syn = self.synonyms.add(syn, target)
             await self.bot.say("Synonym {0} -> {1} added".format(syn, target))
 
         if command == "remove":
             syn = query.split('>')[0].strip().lower()
-            if syn not in self.synonyms.keys():
+            target = self.synonyms.remove(syn)
+            if target is None:
                 await self.bot.say("Synonym {0} not found.".format(syn))
             else:
-                target = self.synonyms[syn]
-                del self.synonyms[syn]
-                fileIO('data/wiki/synonyms.json', 'save', self.synonyms)
                 await self.bot.say("Synonym {0} -> {1} removed".format(syn, target))
 
+        if command == "import":
+            if not ctx.message.attachments:
+                await self.bot.say("Attach a synonyms file to import.")
+                return
+            resp = await self.http.get(ctx.message.attachments[0]["url"])
+            synonyms = self.parse_synonym_list(await resp.text())
+            if not synonyms:
+                await self.bot.say("Couldn't find any synonyms in that file.")
+                return
+            count = self.synonyms.import_synonyms(synonyms)
+            await self.bot.say("Imported {} synonyms".format(count))
+
+        if command == "export":
+            data = json.dumps(self.synonyms.export_synonyms(), indent=4, sort_keys=True)
+            await self.bot.upload(io.BytesIO(data.encode("utf-8")), filename="synonyms.json")
+
     @commands.command(pass_context=True)
     async def wiki(self, ctx, *search_text):
         print("Wiki: Invoked subcommand? {}".format(ctx.invoked_subcommand))
         print("Wiki: subcommand? {}".format(ctx.subcommand_passed))
         if ctx.invoked_subcommand is None:
             query = ' '.join(search_text)
-            if query.lower() in self.synonyms.keys():
-                query = self.synonyms[query.lower()]
+            query = self.synonyms.resolve(query) or query
+
+            match, titles = self.title_index.lookup(query)
+            if match == "exact":
+                await self.bot_say_single_result(self.page_url(titles[0]))
+                return
+            if match == "suggestions":
+                await self.bot_say_results([{"title": t, "link": self.page_url(t)} for t in titles])
+                return
 
-            resp = await self.session.get(self.url(query))
-            if HoggitWiki.was_redirect(resp):
-                await self.bot_say_single_result(resp.url)
+            answer = await self.search(query)
+            if "redirect" in answer:
+                await self.bot_say_single_result(answer["redirect"])
             else:
-                await self.bot_say_search_results(resp)
+                await self.bot_say_results(answer["results"])
+
+    @commands.command(name="wiki-cache")
+    @checks.mod_or_permissions(manage_server=True)
+    async def wiki_cache(self, action: str = "stats"):
+        """
+        Shows hit rate and eviction stats for the wiki search cache. Use `clear` to empty it.
+        """
+        if action == "clear":
+            self.search_cache.clear()
+            await self.bot.say("Wiki search cache cleared")
+            return
+        stats = self.search_cache.stats()
+        await self.bot.say(
+            "Wiki search cache: {entries}/{max_entries} entries, {hits} hits, {misses} misses "
+            "({hit_rate:.0%} hit rate), {expirations} expired, {evictions} evicted, "
+            "{invalidations} invalidated by wiki edits".format(**stats))
 
     @commands.command(name="embed-test")
     async def embed_test(self):
@@ -190,6 +913,20 @@ class HoggitWiki:
         dataIO.save_json('data/wiki/alerts.json', self.alerts)
         await self.bot.say("Started an alert for {}".format(chan.name))
 
+    @commands.command(name="wiki-alert-interval")
+    @checks.mod_or_permissions(manage_server=True)
+    async def alert_interval(self, minutes: int):
+        """
+        Sets how often, in minutes, the wiki is checked for changes to alert on. Minimum 1.
+        """
+        if minutes < 1:
+            await self.bot.say("The interval has to be at least a minute")
+            return
+        self.alerts["interval_minutes"] = minutes
+        dataIO.save_json('data/wiki/alerts.json', self.alerts)
+        await self.start_alerts()
+        await self.bot.say("Checking the wiki for changes every {} minutes".format(minutes))
+
 def setup(bot):
     if not os.path.exists("data/wiki"):
         print("Wiki: Creating data/wiki folder...")